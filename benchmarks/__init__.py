@@ -0,0 +1,110 @@
+"""Microbenchmarks for the code run on every transaction. Each benchmark
+reports operations per second and is compared against the baselines stored
+in ``benchmarks/baselines.json``. The run fails if a benchmark is slower
+than its baseline by more than the tolerance.
+
+Usage::
+
+    # Run benchmarks and compare against baselines
+    python -m benchmarks
+
+    # Record new baselines for this machine
+    python -m benchmarks --save
+
+    # Compare against baselines recorded on a CI runner
+    python -m benchmarks --baselines ci_baselines.json
+
+Baselines are machine specific. The committed baselines were recorded on a
+development machine, CI should record its own with ``--save --baselines``
+and compare against that file.
+"""
+import json
+import os
+import time
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+"""Path of stored baselines."""
+
+BENCHMARKS = []
+"""Registered benchmarks as ``(name, setup)`` tuples."""
+
+
+def benchmark(setup):
+    """Register a benchmark. The decorated function is called once to set
+    up fixtures and must return the function to time."""
+    BENCHMARKS.append((setup.__name__, setup))
+    return setup
+
+
+def run_benchmark(function, min_time=0.5, repeat=3):
+    """Time a function.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*function*", "function", "Function to time."
+        "*min_time*", "number", "Minimum seconds for each timing run."
+        "*repeat*", "number", "Number of timing runs, the fastest is used."
+
+    Returns:
+
+    Dictonary containing `ops_per_sec`.
+    """
+    # Find number of calls that takes at least min_time
+    number = 1
+    while True:
+        start = time.time()
+        for _ in xrange(number):
+            function()
+        elapsed = time.time() - start
+        if elapsed >= min_time / 10:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9) / 10))
+
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        for _ in xrange(number):
+            function()
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+
+    return dict(ops_per_sec=number / best)
+
+
+def load_baselines(path=BASELINES_PATH):
+    """Load stored baselines."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baselines_file:
+        return json.load(baselines_file)
+
+
+def save_baselines(results, path=BASELINES_PATH):
+    """Store results as baselines."""
+    with open(path, 'w') as baselines_file:
+        json.dump(results, baselines_file, indent=4, sort_keys=True,
+                  separators=(',', ': '))
+        baselines_file.write('\n')
+
+
+def compare(result, baseline, tolerance):
+    """Compare a result against its baseline.
+
+    Returns:
+
+    List of regression descriptions, empty if there are none.
+    """
+    regressions = []
+
+    min_ops = baseline['ops_per_sec'] * (1 - tolerance)
+    if result['ops_per_sec'] < min_ops:
+        regressions.append('%.0f ops/sec below baseline %.0f' % (
+            result['ops_per_sec'], baseline['ops_per_sec']))
+
+    return regressions
@@ -0,0 +1,62 @@
+from benchmarks import *
+import benchmarks.hot_paths
+import argparse
+import fnmatch
+import logging
+import sys
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run payment processor microbenchmarks.')
+    parser.add_argument('pattern', nargs='?', default='*',
+                        help='Only run benchmarks matching pattern.')
+    parser.add_argument('--save', action='store_true',
+                        help='Store results as the new baselines.')
+    parser.add_argument('--baselines', default=BASELINES_PATH,
+                        help='Path of baselines file. Default is ' +
+                        'benchmarks/baselines.json.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown before failing. ' +
+                        'Default is 0.25.')
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='Minimum seconds per timing run.')
+    args = parser.parse_args()
+
+    # Keep failover warnings off the console but still format them
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    baselines = load_baselines(args.baselines)
+    results = {}
+    failed = False
+
+    print '%-36s %14s %14s' % ('benchmark', 'ops/sec', 'baseline')
+    for name, setup in BENCHMARKS:
+        if not fnmatch.fnmatch(name, args.pattern):
+            continue
+
+        result = run_benchmark(setup(), args.min_time)
+        results[name] = result
+
+        baseline = baselines.get(name)
+        if baseline == None:
+            status = 'none'
+            regressions = []
+        else:
+            regressions = compare(result, baseline, args.tolerance)
+            status = '%+.1f%%' % ((result['ops_per_sec'] /
+                baseline['ops_per_sec'] - 1) * 100)
+
+        print '%-36s %14.0f %14s' % (name, result['ops_per_sec'], status)
+        for regression in regressions:
+            failed = True
+            print '    REGRESSION: %s' % regression
+
+    if args.save:
+        baselines.update(results)
+        save_baselines(baselines, args.baselines)
+        print 'Saved baselines.'
+    elif failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+from payment_processor.exceptions import *
+from payment_processor.gateways.dummy import Dummy
+from payment_processor.transaction import Transaction
+
+ROUTING_NUMBER = '021000021'
+"""Valid routing number."""
+
+AIM_APPROVED_RESPONSE = '|'.join(['1', '1', '1',
+    'This transaction has been approved.', 'QWE123', 'Y', '2181630452',
+    '43DJ-7203-D897-SS97', 'Order Description', '20.00', 'CC',
+    'auth_capture', '1', 'First', 'Last', '', '1 Somewhere Ave', 'New York',
+    'NY', '46201', '', '', '', '', 'First', 'Last', '', '1 Somewhere Ave',
+    'New York', 'NY', '46201', '', '', '', '', '', '', '',
+    'M', '2', '', 'XXXX0002', 'American Express', '', '', ''])
+"""Recorded Authorize.Net AIM approved delimited response."""
+
+AIM_DECLINED_RESPONSE = '|'.join(['2', '1', '2',
+    'This transaction has been declined.', '', 'N', '2181630453'] +
+    [''] * 31 + ['N'] + [''] * 6)
+"""Recorded Authorize.Net AIM declined delimited response."""
+
+AIM_DETAILS_RESPONSE = u'''<?xml version="1.0" encoding="utf-8"?>
+<getTransactionDetailsResponse xmlns="AnetApi/xml/v1/schema/AnetApiSchema.xsd">
+  <messages>
+    <resultCode>Ok</resultCode>
+    <message><code>I00001</code><text>Successful.</text></message>
+  </messages>
+  <transaction>
+    <transId>2181630452</transId>
+    <submitTimeUTC>2012-06-01T18:20:11.3Z</submitTimeUTC>
+    <submitTimeLocal>2012-06-01T11:20:11.3</submitTimeLocal>
+    <transactionType>authCaptureTransaction</transactionType>
+    <transactionStatus>capturedPendingSettlement</transactionStatus>
+    <responseCode>1</responseCode>
+    <authCode>QWE123</authCode>
+    <authAmount>20.00</authAmount>
+    <settleAmount>20.00</settleAmount>
+    <payment>
+      <creditCard>
+        <cardNumber>XXXX0002</cardNumber>
+        <expirationDate>XXXX</expirationDate>
+        <cardType>AmericanExpress</cardType>
+      </creditCard>
+    </payment>
+    <billTo>
+      <firstName>First</firstName>
+      <lastName>Last</lastName>
+      <address>1 Somewhere Ave</address>
+      <city>New York</city>
+      <state>NY</state>
+      <zip>46201</zip>
+    </billTo>
+    <shipTo>
+      <firstName>First</firstName>
+      <lastName>Last</lastName>
+      <address>1 Somewhere Ave</address>
+      <city>New York</city>
+      <state>NY</state>
+      <zip>46201</zip>
+    </shipTo>
+  </transaction>
+</getTransactionDetailsResponse>'''
+"""Recorded Authorize.Net getTransactionDetails response."""
+
+
+class FailingDummy(Dummy):
+    """Dummy gateway that always fails to connect."""
+    provider = 'failing_dummy'
+
+    def _charge(self, transaction):
+        raise ConnectionError('Failed to connect.')
+
+
+def card_transaction(gateway):
+    """Create a fully filled in credit card transaction."""
+    transaction = Transaction(gateway)
+    transaction.card_number = 370000000000002
+    transaction.expiration_month = 1
+    transaction.expiration_year = 2015
+    transaction.security_code = '1234'
+    transaction.first_name = 'First'
+    transaction.last_name = 'Last'
+    transaction.address = '1 Somewhere Ave'
+    transaction.city = 'New York'
+    transaction.state = 'NY'
+    transaction.zip_code = '46201'
+    transaction.customer_id = 1
+    transaction.description = 'Order Description'
+    transaction.customer_ip = '65.192.14.10'
+    transaction.amount = 20.00
+    transaction.order_number = '43DJ-7203-D897-SS97'
+    transaction.ship_first_name = 'First'
+    transaction.ship_last_name = 'Last'
+    transaction.ship_address = '1 Somewhere Ave'
+    transaction.ship_city = 'New York'
+    transaction.ship_state = 'NY'
+    transaction.ship_zip_code = '46201'
+    transaction.ship_phone = '111-222-3333'
+    transaction.ship_email = 'user@domain.com'
+    return transaction
+
+
+def check_transaction(gateway):
+    """Create a fully filled in check transaction."""
+    transaction = card_transaction(gateway)
+    transaction.card_number = None
+    transaction.check_account_number = '123456789'
+    transaction.check_routing_number = ROUTING_NUMBER
+    transaction.check_account_type = Transaction.PERSONAL_CHECKING
+    transaction.check_account_name = 'First Last'
+    transaction.check_transaction_type = Transaction.WEB
+    return transaction
@@ -0,0 +1,108 @@
+from benchmarks import benchmark
+from benchmarks.fixtures import *
+from payment_processor.exceptions import *
+from payment_processor.counter import GatewayCounter, counted_gateway
+from payment_processor.gateway import MultiGateway
+from payment_processor.gateways.authorize_net import AuthorizeNetAIM
+from payment_processor.gateways.national_processing import \
+    NationalProcessing
+from payment_processor.gateways.dummy import Dummy
+
+@benchmark
+def authorize_net_get_params():
+    gateway = AuthorizeNetAIM('login', 'trans_key')
+    transaction = card_transaction(gateway)
+    return lambda: gateway._get_params(transaction)
+
+@benchmark
+def authorize_net_get_params_check():
+    gateway = AuthorizeNetAIM('login', 'trans_key')
+    transaction = check_transaction(gateway)
+    return lambda: gateway._get_params(transaction)
+
+@benchmark
+def national_processing_get_params():
+    gateway = NationalProcessing('username', 'password')
+    transaction = card_transaction(gateway)
+    return lambda: gateway._get_params(transaction)
+
+@benchmark
+def authorize_net_delim_approved():
+    gateway = AuthorizeNetAIM('login', 'trans_key')
+    transaction = card_transaction(gateway)
+    return lambda: gateway._handle_delim_response(transaction,
+                                                  AIM_APPROVED_RESPONSE)
+
+@benchmark
+def authorize_net_delim_declined():
+    gateway = AuthorizeNetAIM('login', 'trans_key')
+    transaction = card_transaction(gateway)
+
+    def run():
+        try:
+            gateway._handle_delim_response(transaction,
+                                           AIM_DECLINED_RESPONSE)
+        except TransactionDeclined:
+            pass
+
+    return run
+
+@benchmark
+def authorize_net_xml_details():
+    gateway = AuthorizeNetAIM('login', 'trans_key')
+    transaction = card_transaction(gateway)
+    return lambda: gateway._handle_xml_response(transaction,
+                                                AIM_DETAILS_RESPONSE)
+
+@benchmark
+def routing_number_checkdigit():
+    gateway = Dummy()
+    return lambda: gateway._valid_routing_number_checkdigit(ROUTING_NUMBER)
+
+@benchmark
+def counter_get_counts():
+    gateway = counted_gateway(Dummy, GatewayCounter)()
+    return gateway.get_counts
+
+@benchmark
+def counter_set_counts():
+    gateway = counted_gateway(Dummy, GatewayCounter)()
+
+    def run():
+        gateway.set_counts(20.0, 20.0, 1, 1)
+        gateway.set_counts(-20.0, -20.0, -1, -1)
+
+    return run
+
+@benchmark
+def counter_usage():
+    gateway = counted_gateway(Dummy, GatewayCounter)(day_trans_limit=1000)
+    return gateway.usage
+
+@benchmark
+def counter_reserve_release():
+    gateway = counted_gateway(Dummy, GatewayCounter)()
+    return lambda: gateway.reserve(20.0).release()
+
+@benchmark
+def counter_charge():
+    gateway = counted_gateway(Dummy, GatewayCounter)()
+    transaction = card_transaction(gateway)
+
+    def run():
+        gateway._charge(transaction)
+        gateway.set_counts(-20.0, -20.0, -1, -1)
+
+    return run
+
+@benchmark
+def multi_gateway_first_success():
+    gateway = MultiGateway(Dummy(), Dummy())
+    transaction = card_transaction(gateway)
+    return lambda: gateway._send_transaction(transaction, '_charge')
+
+@benchmark
+def multi_gateway_failover():
+    gateway = MultiGateway(FailingDummy(), Dummy())
+    transaction = card_transaction(gateway)
+    return lambda: gateway._send_transaction(transaction, '_charge')
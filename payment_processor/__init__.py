@@ -1,15 +1,35 @@
 from payment_processor.exceptions import *
 from payment_processor.constants import *
 from payment_processor.gateway import MultiGateway
+from payment_processor.circuit_breaker import CircuitBreaker
+from payment_processor.gateway_stats import GatewayStats
+from payment_processor.metrics import MetricsRegistry
 from payment_processor.gateways.authorize_net import AuthorizeNetAIM
 from payment_processor.gateways.national_processing import NationalProcessing
 from payment_processor.gateways.dummy import Dummy
 from payment_processor.transaction import Transaction
 from payment_processor.counter import GatewayCounter, counted_gateway
+from payment_processor.window import WindowLimit
+from payment_processor.lease_counter import leased_counter
 
 # Attempt to import optional sql counter
 try:
     from payment_processor.sql_counter import SQLGatewayCounter
-    from payment_processor.database import connect_database
+    from payment_processor.database import connect_database, migrate_database
+    from payment_processor.journal import TransactionJournal
 except SQLEngineNotAviable:
     pass
+
+# Attempt to import optional shared memory counter
+try:
+    from payment_processor.shm_counter import (SharedMemoryGatewayCounter,
+        connect_shared_memory)
+except SharedMemoryNotAviable:
+    pass
+
+# Attempt to import optional redis counter
+try:
+    from payment_processor.redis_counter import (RedisGatewayCounter,
+        connect_redis)
+except RedisNotAviable:
+    pass
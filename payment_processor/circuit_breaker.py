@@ -0,0 +1,134 @@
+from payment_processor.exceptions import *
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker(object):
+    """Gateway circuit breaker. The breaker opens after a number of
+    consecutive gateway failures, while open requests to the gateway are
+    skipped. After the recovery timeout one probe request is let through
+    (half open), if it succeeds the breaker closes otherwise it opens again.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*failure_threshold*", "number", "Number of consecutive failures
+        before the breaker opens. Default is `5`."
+        "*recovery_timeout*", "number", "Seconds to wait before probing an
+        open gateway. Default is `30`."
+    """
+    failure_threshold = None
+    """Number of consecutive failures before the breaker opens."""
+    recovery_timeout = None
+    """Seconds to wait before probing an open gateway."""
+    state = CLOSED
+    """Current state ``closed``, ``open`` or ``half_open``."""
+    failure_count = 0
+    """Number of consecutive failures."""
+    opened_time = None
+    """Time the breaker was last opened."""
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._probing = False
+        self._lock = threading.Lock()
+        self._state_handlers = []
+
+    def _set_state(self, state):
+        """Set breaker state. Must be called with lock held.
+
+        Returns:
+
+        Previous state.
+        """
+        previous_state = self.state
+        self.state = state
+        if state == OPEN:
+            self.opened_time = time.time()
+        return previous_state
+
+    def _notify(self, previous_state, state):
+        """Call state change handlers if state has changed."""
+        if previous_state != state:
+            for handler in self._state_handlers:
+                handler(self, previous_state, state)
+
+    def allow_request(self):
+        """Check if a request can be sent to the gateway.
+
+        Returns:
+
+        ``True`` if the request can be sent ``False`` if the gateway should
+        be skipped.
+        """
+        # Fast path without lock
+        if self.state == CLOSED:
+            return True
+
+        with self._lock:
+            previous_state = self.state
+
+            if self.state == OPEN:
+                if time.time() - self.opened_time < self.recovery_timeout:
+                    return False
+                self._set_state(HALF_OPEN)
+
+            # Only one probe request at a time while half open
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    allowed = False
+                else:
+                    self._probing = True
+                    allowed = True
+            else:
+                allowed = True
+
+            state = self.state
+
+        self._notify(previous_state, state)
+        return allowed
+
+    def record_success(self):
+        """Record a successful request to the gateway."""
+        if self.state == CLOSED and self.failure_count == 0:
+            return
+
+        with self._lock:
+            self.failure_count = 0
+            self._probing = False
+            previous_state = self._set_state(CLOSED)
+
+        self._notify(previous_state, CLOSED)
+
+    def record_failure(self):
+        """Record a failed request to the gateway."""
+        with self._lock:
+            self.failure_count += 1
+            self._probing = False
+            previous_state = self.state
+
+            if (self.state == HALF_OPEN or
+                    self.failure_count >= self.failure_threshold):
+                self._set_state(OPEN)
+
+            state = self.state
+
+        self._notify(previous_state, state)
+
+    def release(self):
+        """Release a probe request without recording a result."""
+        with self._lock:
+            self._probing = False
+
+    def on_state_change(self, handler):
+        """Add a handler called with the breaker, previous state and new
+        state when the breaker state changes."""
+        self._state_handlers.append(handler)
+        return handler
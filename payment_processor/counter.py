@@ -1,10 +1,158 @@
 from payment_processor.exceptions import *
 from payment_processor.gateway import BaseGateway
+from payment_processor.timing import COUNTER
+from payment_processor.window import WindowCounts
 import datetime
+import logging
+import threading
+import time
+
+PENDING = 'pending'
+COMMITTED = 'committed'
+RELEASED = 'released'
+
+class PeriodClock(object):
+    """Cached day and month period numbers. The day period is the ordinal of
+    the local date and the month period is ``year * 12 + month - 1``. The
+    periods are only derived from the date again after local midnight.
+    """
+
+    def __init__(self):
+        self._periods = None
+        self._boundary = 0
+        self._lock = threading.Lock()
+
+    def get_periods(self):
+        """Get current periods.
+
+        Returns:
+
+        A tuple containing `day`, `month`
+        """
+        if time.time() >= self._boundary:
+            with self._lock:
+                if time.time() >= self._boundary:
+                    current_date = datetime.date.today()
+                    next_date = current_date + datetime.timedelta(days=1)
+                    self._periods = (current_date.toordinal(),
+                        current_date.year * 12 + current_date.month - 1)
+                    self._boundary = time.mktime(next_date.timetuple())
+
+        return self._periods
+
+
+period_clock = PeriodClock()
+"""Shared period clock used by counters."""
+
+
+class CounterState(object):
+    """In memory counts of one gateway provider."""
+    __slots__ = ('lock', 'day', 'month', 'day_amount_count',
+                 'month_amount_count', 'day_trans_count', 'month_trans_count',
+                 'windows')
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.day = None
+        self.month = None
+        self.day_amount_count = 0
+        self.month_amount_count = 0
+        self.day_trans_count = 0
+        self.month_trans_count = 0
+        self.windows = {}
+
+    def get_window(self, window_limit):
+        """Get window counts of window limit. Must be called with lock
+        held."""
+        key = (window_limit.seconds, window_limit.buckets)
+        window = self.windows.get(key)
+        if window == None:
+            window = WindowCounts(window_limit.buckets)
+            self.windows[key] = window
+        return window
+
+    def roll(self, day, month):
+        """Reset counts from a previous period. Must be called with lock
+        held."""
+        if self.day != day:
+            self.day = day
+            self.day_amount_count = 0
+            self.day_trans_count = 0
+        if self.month != month:
+            self.month = month
+            self.month_amount_count = 0
+            self.month_trans_count = 0
+
+
+_counter_states = {}
+_counter_states_lock = threading.Lock()
+
+class CounterReservation(object):
+    """Counts reserved by :meth:`GatewayCounter.reserve`. Commit the
+    reservation once the transaction has gone through or release it to
+    return the counts.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*counter*", "object", "Counter the counts were reserved on."
+        "*amount*", "number", "Reserved amount."
+        "*trans*", "number", "Reserved number of transactions."
+        "*day*", "number", "Day period of the reservation. Default is the
+        current period."
+        "*month*", "number", "Month period of the reservation. Default is the
+        current period."
+        "*reserved_time*", "number", "Unix time of the reservation. Default
+        is the current time."
+    """
+    counter = None
+    """Counter the counts were reserved on."""
+    amount = None
+    """Reserved amount."""
+    trans = None
+    """Reserved number of transactions."""
+    day = None
+    """Day period the counts were reserved in."""
+    month = None
+    """Month period the counts were reserved in."""
+    reserved_time = None
+    """Unix time the counts were reserved."""
+    state = PENDING
+    """Current state ``pending``, ``committed`` or ``released``."""
+
+    def __init__(self, counter, amount, trans, day=None, month=None,
+                 reserved_time=None):
+        if day == None or month == None:
+            day, month = period_clock.get_periods()
+        self.counter = counter
+        self.amount = amount
+        self.trans = trans
+        self.day = day
+        self.month = month
+        self.reserved_time = reserved_time or time.time()
+
+    def commit(self):
+        """Keep the reserved counts."""
+        if self.state != PENDING:
+            return
+        self.state = COMMITTED
+        self.counter._commit_reservation(self)
+
+    def release(self):
+        """Return the reserved counts to the counter."""
+        if self.state != PENDING:
+            return
+        self.state = RELEASED
+        self.counter._release_reservation(self)
+
 
 class GatewayCounter:
     """Gateway transaction counter. Handles day/month transaction count and
-    amount total.
+    amount total. Counts are kept in memory for each gateway provider and
+    shared by all counted gateways of the provider in the process.
 
     Arguments:
 
@@ -20,6 +168,10 @@ class GatewayCounter:
         in one day."
         "*month_trans_limit*", "number", "Number of transaction that can occur
         in one month."
+        "*window_limits*", "list", "List of :attr:`WindowLimit` sliding window
+        limits."
+        "*usage_ttl*", "number", "Seconds a :meth:`usage` snapshot is cached
+        before it is refreshed in the background. Default is `5`."
     """
     day_amount_limit = None
     """Total amount of money that can be transferred in one day."""
@@ -29,24 +181,47 @@ class GatewayCounter:
     """Number of transaction that can occur in one day."""
     month_trans_limit = None
     """Number of transaction that can occur in one month."""
-    _day_amount_count = [0, datetime.date.today().strftime('%Y%m%d')]
-    _month_amount_count = [0, datetime.date.today().strftime('%Y%m%d')]
-    _day_trans_count = [0, datetime.date.today().strftime('%Y%m')]
-    _month_trans_count = [0, datetime.date.today().strftime('%Y%m')]
+    window_limits = ()
+    """List of sliding window limits."""
+    usage_ttl = 5
+    """Seconds a usage snapshot is cached."""
+    _usage = None
+    _usage_refreshing = False
+    _window_limits_supported = True
     _base_gateway = None
+    _counter_state = None
 
     def __init__(self, day_amount_limit=None, month_amount_limit=None,
             day_trans_limit=None, month_trans_limit=None, *args, **kwargs):
+        window_limits = kwargs.pop('window_limits', ())
+        usage_ttl = kwargs.pop('usage_ttl', 5)
+        if window_limits and not self._window_limits_supported:
+            raise TypeError('Window limits are not supported by counter.')
+
         self._base_gateway.__init__(self, *args, **kwargs)
         self.day_amount_limit = day_amount_limit
         self.month_amount_limit = month_amount_limit
         self.day_trans_limit = day_trans_limit
         self.month_trans_limit = month_trans_limit
-
-    def _check_counts(self, day_amount_change, month_amount_change,
-                   day_trans_change, month_trans_change):
-        """Check counters against limits.  Changes can be positive and
-        negative.
+        self.window_limits = tuple(window_limits)
+        self.usage_ttl = usage_ttl
+        self._usage_lock = threading.Lock()
+
+    def _get_counter_state(self):
+        """Get in memory counts of gateway provider."""
+        if self._counter_state == None:
+            with _counter_states_lock:
+                state = _counter_states.get(self.provider)
+                if state == None:
+                    state = CounterState()
+                    _counter_states[self.provider] = state
+            self._counter_state = state
+
+        return self._counter_state
+
+    def _check_limits(self, day_amount_count, month_amount_count,
+                      day_trans_count, month_trans_count):
+        """Check new counts against limits.
 
         Arguments:
 
@@ -54,24 +229,15 @@ class GatewayCounter:
             :header: "argument", "type", "value"
             :widths: 7, 7, 40
 
-            "*day_amount_change*", "number", "Change in day amount count."
-            "*month_amount_change*", "number", "Change in month amount count."
-            "*day_trans_change*", "number", "Change in day trans count."
-            "*month_trans_change*", "number", "Change in month trans count."
+            "*day_amount_count*", "number", "Day amount count."
+            "*month_amount_count*", "number", "Month amount count."
+            "*day_trans_count*", "number", "Day trans count."
+            "*month_trans_count*", "number", "Month trans count."
 
         Raises:
 
         :attr:`LimitExceeded` If a limit has been exceeded.
         """
-        counts = self.get_counts()
-
-        # Add change to counts
-        day_amount_count = counts[0] + day_amount_change
-        month_amount_count = counts[1] + month_amount_change
-        day_trans_count = counts[2] + day_trans_change
-        month_trans_count = counts[3] + month_trans_change
-
-        # Check counts
         if (day_amount_count >= self.day_amount_limit and
                 self.day_amount_limit != None):
             raise LimitExceeded('Gateway day amount limit reached.')
@@ -88,6 +254,117 @@ class GatewayCounter:
                 self.month_trans_limit != None):
             raise LimitExceeded('Gateway month transaction limit reached.')
 
+    def _check_counts(self, day_amount_change, month_amount_change,
+                   day_trans_change, month_trans_change):
+        """Check counters against limits.  Changes can be positive and
+        negative.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*day_amount_change*", "number", "Change in day amount count."
+            "*month_amount_change*", "number", "Change in month amount count."
+            "*day_trans_change*", "number", "Change in day trans count."
+            "*month_trans_change*", "number", "Change in month trans count."
+
+        Raises:
+
+        :attr:`LimitExceeded` If a limit has been exceeded.
+        """
+        counts = self.get_counts()
+
+        # Add change to counts and check
+        self._check_limits(counts[0] + day_amount_change,
+                           counts[1] + month_amount_change,
+                           counts[2] + day_trans_change,
+                           counts[3] + month_trans_change)
+
+    def _check_windows(self, amount, trans, now):
+        """Check in memory window counts against window limits. Must be
+        called with counter state lock held."""
+        state = self._get_counter_state()
+
+        for window_limit in self.window_limits:
+            amount_count, trans_count = state.get_window(
+                window_limit).get_counts(window_limit.get_epoch(now))
+            window_limit.check(amount_count + amount, trans_count + trans)
+
+    def _change_windows(self, amount, trans, now):
+        """Add counts to in memory windows. Must be called with counter
+        state lock held."""
+        state = self._get_counter_state()
+
+        for window_limit in self.window_limits:
+            state.get_window(window_limit).change(
+                window_limit.get_epoch(now), amount, trans)
+
+    def reserve(self, amount, trans=1):
+        """Check limits and reserve counts. Override this method if the
+        counter storage can check and increase counts in one operation.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*amount*", "number", "Amount to reserve."
+            "*trans*", "number", "Number of transactions to reserve."
+
+        Returns:
+
+        :attr:`CounterReservation`
+
+        Raises:
+
+        :attr:`LimitExceeded` If a limit has been exceeded.
+        """
+        # Lock provider counts so no other thread can change them between
+        # check and set
+        with self._get_counter_state().lock:
+            day, month = period_clock.get_periods()
+            now = time.time()
+            self._check_counts(amount, amount, trans, trans)
+            if self.window_limits:
+                self._check_windows(amount, trans, now)
+            self.set_counts(amount, amount, trans, trans)
+            if self.window_limits:
+                self._change_windows(amount, trans, now)
+
+        return CounterReservation(self, amount, trans, day, month, now)
+
+    def _commit_reservation(self, reservation):
+        """Called when a reservation is committed. Counts are already set
+        by :meth:`reserve`, override this method if the counter storage
+        needs to confirm them."""
+        pass
+
+    def _release_reservation(self, reservation):
+        """Called when a reservation is released. Override this method to
+        return counts to the counter storage, it may batch or defer the
+        change. Counts are only returned to the day and month they were
+        reserved in."""
+        day, month = period_clock.get_periods()
+        same_day = reservation.day == day
+        same_month = reservation.month == month
+
+        state = self._get_counter_state()
+        with state.lock:
+            self.set_counts(
+                reservation.amount * -1 if same_day else 0,
+                reservation.amount * -1 if same_month else 0,
+                reservation.trans * -1 if same_day else 0,
+                reservation.trans * -1 if same_month else 0)
+
+            # Counts are only removed from buckets still in the window
+            for window_limit in self.window_limits:
+                state.get_window(window_limit).release(
+                    window_limit.get_epoch(reservation.reserved_time),
+                    reservation.amount, reservation.trans)
+
     def _charge(self, transaction):
         """Override charge method to handle counters."""
         # Check for transaction amount
@@ -95,18 +372,23 @@ class GatewayCounter:
             raise TypeError('Transaction.amount is required for ' +
                             'counter gateways.')
 
-        # Check and increase counts
-        self._check_counts(transaction.amount, transaction.amount, 1, 1)
-        self.set_counts(transaction.amount, transaction.amount, 1, 1)
+        # Check and reserve counts
+        reservation = self.reserve(transaction.amount)
+
+        if transaction._timer != None:
+            transaction._timer.mark(COUNTER)
 
         try:
-            return self._base_gateway._charge(self, transaction)
+            response = self._base_gateway._charge(self, transaction)
         except Exception:
-            # Undo counts then raise exception
-            self.set_counts(
-                    transaction.amount * -1, transaction.amount * -1, -1, -1)
+            # Return counts then raise exception
+            reservation.release()
             raise
 
+        reservation.commit()
+        self._change_usage(transaction.amount, 1)
+        return response
+
     def _capture(self, transaction):
         """Override capture method to handle counters."""
         # Check for transaction amount
@@ -114,43 +396,131 @@ class GatewayCounter:
             raise TypeError('Transaction.amount is required for ' +
                             'counter gateways.')
 
-        # Check and increase counts
-        self._check_counts(transaction.amount, transaction.amount, 1, 1)
-        self.set_counts(transaction.amount, transaction.amount, 1, 1)
+        # Check and reserve counts
+        reservation = self.reserve(transaction.amount)
+
+        if transaction._timer != None:
+            transaction._timer.mark(COUNTER)
 
         try:
-            return self._base_gateway._capture(self, transaction)
+            response = self._base_gateway._capture(self, transaction)
         except Exception:
-            # Undo counts then raise exception
-            self.set_counts(
-                    transaction.amount * -1, transaction.amount * -1, -1, -1)
+            # Return counts then raise exception
+            reservation.release()
             raise
 
+        reservation.commit()
+        self._change_usage(transaction.amount, 1)
+        return response
+
+    def _refresh_usage(self):
+        """Read counts for usage snapshot."""
+        day, month = period_clock.get_periods()
+        counts = list(self.get_counts())
+
+        with self._usage_lock:
+            self._usage = [day, month, counts, time.time()]
+            self._usage_refreshing = False
+
+    def _refresh_usage_async(self):
+        """Read counts for usage snapshot from the gateway thread pool."""
+        try:
+            self._refresh_usage()
+        except Exception:
+            with self._usage_lock:
+                self._usage_refreshing = False
+            logging.exception('Failed to refresh counter usage.')
+
+    def _roll_usage(self, day, month):
+        """Reset cached usage counts from a previous period. Must be called
+        with usage lock held."""
+        usage = self._usage
+        if usage[0] != day:
+            usage[0] = day
+            usage[2][0] = 0
+            usage[2][2] = 0
+        if usage[1] != month:
+            usage[1] = month
+            usage[2][1] = 0
+            usage[2][3] = 0
+
+    def _change_usage(self, amount, trans):
+        """Add counts of this process to cached usage."""
+        if self._usage == None:
+            return
+
+        day, month = period_clock.get_periods()
+        with self._usage_lock:
+            self._roll_usage(day, month)
+            counts = self._usage[2]
+            counts[0] += amount
+            counts[1] += amount
+            counts[2] += trans
+            counts[3] += trans
+
+    def usage(self):
+        """Get usage snapshot of counts, limits and remaining headroom. The
+        snapshot is cached and refreshed in the background after
+        :attr:`usage_ttl` seconds, transactions of this process are added
+        to the cached counts. Only the first call reads the counter storage.
+
+        Returns:
+
+        Dictonary containing `day_amount`, `month_amount`, `day_trans` and
+        `month_trans`. Each contains `count`, `limit` and `remaining`,
+        `limit` and `remaining` are ``None`` without a limit. `updated`
+        is the time the counts were read.
+        """
+        if self._usage == None:
+            self._refresh_usage()
+        elif (time.time() - self._usage[3] >= self.usage_ttl and
+                not self._usage_refreshing):
+            with self._usage_lock:
+                refresh = not self._usage_refreshing
+                self._usage_refreshing = True
+            if refresh:
+                self._get_async_pool().apply_async(self._refresh_usage_async)
+
+        day, month = period_clock.get_periods()
+        with self._usage_lock:
+            self._roll_usage(day, month)
+            counts = list(self._usage[2])
+            updated = self._usage[3]
+
+        usage = dict(updated=updated)
+        for name, count, limit in (
+                ('day_amount', counts[0], self.day_amount_limit),
+                ('month_amount', counts[1], self.month_amount_limit),
+                ('day_trans', counts[2], self.day_trans_limit),
+                ('month_trans', counts[3], self.month_trans_limit)):
+            usage[name] = dict(
+                count=count,
+                limit=limit,
+                remaining=max(limit - count, 0) if limit != None else None,
+            )
+
+        return usage
+
     def get_counts(self):
         """Override this method with a method to get current counts. It must
-        return a tuple containing current counts.
+        return a tuple containing current counts. Counter storages that
+        override this method should also override :meth:`reserve` and
+        :meth:`_release_reservation`.
 
         Returns:
 
         A tuple containing `day_amount_count`, `month_amount_count`,
         `day_trans_count`, `month_trans_count`
         """
-        current_date = datetime.date.today()
-        day_timestamp = current_date.strftime('%Y%m%d')
-        month_timestamp = current_date.strftime('%Y%m')
-
-        # If timestamp has changed reset count
-        if self._day_amount_count[1] != day_timestamp:
-            self._day_amount_count = [0, day_timestamp]
-        if self._month_amount_count[1] != month_timestamp:
-            self._month_amount_count = [0, month_timestamp]
-        if self._day_trans_count[1] != day_timestamp:
-            self._day_trans_count = [0, day_timestamp]
-        if self._month_trans_count[1] != month_timestamp:
-            self._month_trans_count = [0, month_timestamp]
-
-        return (self._day_amount_count[0], self._month_amount_count[0],
-                self._day_trans_count[0], self._month_trans_count[0])
+        day, month = period_clock.get_periods()
+        state = self._get_counter_state()
+
+        with state.lock:
+            # If period has changed reset count
+            state.roll(day, month)
+
+            return (state.day_amount_count, state.month_amount_count,
+                    state.day_trans_count, state.month_trans_count)
 
     def set_counts(self, day_amount_change, month_amount_change,
                    day_trans_change, month_trans_change):
@@ -168,13 +538,18 @@ class GatewayCounter:
             "*day_trans_change*", "number", "Change in day trans count."
             "*month_trans_change*", "number", "Change in month trans count."
         """
-        current_date = datetime.date.today()
-
-        # Increase counts
-        self._day_amount_count[0] += day_amount_change
-        self._month_amount_count[0] += month_amount_change
-        self._day_trans_count[0] += day_trans_change
-        self._month_trans_count[0] += month_trans_change
+        day, month = period_clock.get_periods()
+        state = self._get_counter_state()
+
+        with state.lock:
+            # If period has changed reset count
+            state.roll(day, month)
+
+            # Increase counts
+            state.day_amount_count += day_amount_change
+            state.month_amount_count += month_amount_change
+            state.day_trans_count += day_trans_change
+            state.month_trans_count += month_trans_change
 
 
 def counted_gateway(base_gateway, gateway_counter):
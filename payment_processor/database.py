@@ -1,31 +1,170 @@
 from payment_processor.exceptions import *
+from payment_processor.counter import period_clock
+import contextlib
 import datetime
+import threading
 
 # Import sqlalchemy if not aviable the database module will be exlcuded
 try:
     from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
-    from sqlalchemy import Column, Integer, Float, String
+    from sqlalchemy.engine.url import make_url
+    from sqlalchemy.orm import scoped_session, sessionmaker
+    from sqlalchemy.exc import SQLAlchemyError
+    from sqlalchemy import (Column, Integer, BigInteger, Float, String,
+        DateTime, UniqueConstraint, MetaData, Table)
     from sqlalchemy.ext.declarative import declarative_base
 except ImportError:
     import logging
     logging.warning('SQLAlchemy not aviable, removing SQLCounter.')
     raise SQLEngineNotAviable('SQLAlchemy not aviable.')
 
-TABLE_NAME = 'payment_processor'
+TABLE_NAME = 'payment_processor_counter'
 """Name of sql table for counters."""
 
+LEGACY_TABLE_NAME = 'payment_processor'
+"""Name of sql table for counters before version 2 of the schema."""
 
-Session = sessionmaker()
-"""SQL database session."""
+WINDOW_TABLE_NAME = 'payment_processor_window'
+"""Name of sql table for window counters."""
+
+JOURNAL_TABLE_NAME = 'payment_processor_journal'
+"""Name of sql table for the transaction journal."""
+
+
+Session = scoped_session(sessionmaker())
+"""SQL database session, each thread is given its own session."""
 
 
 Base = declarative_base()
 """Base class for sql tables."""
 
+_engine = None
+_engine_lock = threading.Lock()
+_sql_connection = None
+_engine_options = {}
+_create_tables = True
+_session_scopes = threading.local()
+
+
+def _create_all(engine):
+    """Create tables that dont exist. Processes that use the database for the
+    first time at the same time can create the same table, create then fails
+    in all but one of them. The error is ignored if the table exists.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*engine*", "object", "SQL alchemy engine."
+    """
+    for table in Base.metadata.sorted_tables:
+        try:
+            table.create(engine, checkfirst=True)
+        except SQLAlchemyError:
+            # Table created by another process
+            if not engine.has_table(table.name):
+                raise
+
+
+def get_engine():
+    """Get sql database engine. The engine is created on first use after
+    :func:`connect_database` and tables that dont exist are created once.
+
+    Raises:
+
+    :attr:`CounterError` If database has not been connected or the engine
+    could not be created.
+
+    Returns:
+
+    SQL alchemy engine.
+    """
+    global _engine
+
+    if _engine != None:
+        return _engine
+
+    with _engine_lock:
+        if _engine == None:
+            if _sql_connection == None:
+                raise CounterError('Database not connected.')
+
+            url = make_url(_sql_connection)
+            options = {}
+            # Sqlite uses pools that dont accept a size
+            if url.get_backend_name() != 'sqlite':
+                options.update(pool_size=40, pool_recycle=3600)
+            options.update(_engine_options)
+
+            engine = None
+            try:
+                engine = create_engine(url, **options)
+                if _create_tables:
+                    _create_all(engine)
+            except SQLAlchemyError, exception:
+                if engine != None:
+                    engine.dispose()
+                raise CounterError(exception)
+
+            Session.configure(bind=engine)
+            _engine = engine
+
+    return _engine
+
+
+@contextlib.contextmanager
+def session_scope():
+    """Provide a transaction on the session of the current thread. The
+    transaction is commited when the block exits and rolled back if it
+    raises, the connection is always returned to the pool. A scope inside
+    another scope joins the transaction of the outer scope.
+
+    Raises:
+
+    :attr:`CounterError` If a database error occurred.
+
+    Usage::
+
+        with session_scope() as session:
+            session.add(CounterTable('dummy'))
+    """
+    if getattr(_session_scopes, 'depth', 0):
+        _session_scopes.depth += 1
+        try:
+            yield Session()
+        finally:
+            _session_scopes.depth -= 1
+        return
+
+    _session_scopes.depth = 1
+    session = None
+    try:
+        # Engine is created before the session so the session is bound
+        get_engine()
+        session = Session()
+        yield session
+        session.commit()
+    except SQLAlchemyError, exception:
+        if session != None:
+            session.rollback()
+        raise CounterError(exception)
+    except:
+        if session != None:
+            session.rollback()
+        raise
+    finally:
+        _session_scopes.depth = 0
+        if session != None:
+            session.close()
+
 
 class CounterTable(Base):
-    """SQL counter table.
+    """SQL counter table. Amounts are stored in cents and periods as period
+    numbers of :attr:`period_clock`. Counters of a gateway provider can be
+    split across shard rows, the counts of the provider are the sum of its
+    rows.
 
     Arguments:
 
@@ -34,39 +173,139 @@ class CounterTable(Base):
         :widths: 7, 7, 40
 
         "*provider*", "string", "Gateway provider."
+        "*shard*", "number", "Shard number. Default is `0`."
     """
     __tablename__ = TABLE_NAME
+    __table_args__ = (UniqueConstraint('provider', 'shard'),)
 
     id = Column(Integer, primary_key=True)
     """Column ID (Primary Key)."""
-    provider = Column(String(64))
+    provider = Column(String(64), nullable=False, index=True)
     """Gateway provider."""
-    day_amount_count = Column(Float)
-    """Total amount count for day."""
-    month_amount_count = Column(Float)
-    """Total amount count for month."""
-    day_trans_count = Column(Integer)
+    shard = Column(Integer, nullable=False, default=0)
+    """Shard number of counts."""
+    day_amount_count = Column(BigInteger, nullable=False)
+    """Total amount count for day in cents."""
+    month_amount_count = Column(BigInteger, nullable=False)
+    """Total amount count for month in cents."""
+    day_trans_count = Column(Integer, nullable=False)
     """Total number of transactions for day."""
-    month_trans_count = Column(Integer)
+    month_trans_count = Column(Integer, nullable=False)
     """Total number of transactions for month."""
-    day_count_timestamp = Column(String(8))
-    """Timestamp of day count YYYYMMDD."""
-    month_count_timestamp = Column(String(6))
-    """Timestamp of month count YYYYMM."""
+    day = Column(Integer, nullable=False)
+    """Day period of day counts."""
+    month = Column(Integer, nullable=False)
+    """Month period of month counts."""
 
-    def __init__(self, provider):
+    def __init__(self, provider, shard=0):
         self.provider = provider
-        self.day_amount_count = 0.0
-        self.month_amount_count = 0.0
+        self.shard = shard
+        self.day_amount_count = 0
+        self.month_amount_count = 0
         self.day_trans_count = 0
         self.month_trans_count = 0
-        self.day_count_timestamp = datetime.date.today().strftime('%Y%m%d')
-        self.month_count_timestamp = datetime.date.today().strftime('%Y%m')
+        self.day, self.month = period_clock.get_periods()
+
 
+LegacyCounterTable = Table(LEGACY_TABLE_NAME, MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('provider', String(64)),
+    Column('day_amount_count', Float),
+    Column('month_amount_count', Float),
+    Column('day_trans_count', Integer),
+    Column('month_trans_count', Integer),
+    Column('day_count_timestamp', String(8)),
+    Column('month_count_timestamp', String(6)),
+)
+"""SQL counter table before version 2 of the schema. Amounts were stored as
+floats and periods as YYYYMMDD and YYYYMM strings."""
 
-def connect_database(sql_connection):
-    """Connection to sql database. If table doesn't exists on database it will
-    be created.
+
+class CounterWindowTable(Base):
+    """SQL window counter table. Each window has one row for each time
+    bucket.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*provider*", "string", "Gateway provider."
+        "*window_seconds*", "number", "Length of window in seconds."
+        "*bucket*", "number", "Bucket slot."
+    """
+    __tablename__ = WINDOW_TABLE_NAME
+    __table_args__ = (UniqueConstraint('provider', 'window_seconds', 'bucket'),)
+
+    id = Column(Integer, primary_key=True)
+    """Column ID (Primary Key)."""
+    provider = Column(String(64))
+    """Gateway provider."""
+    window_seconds = Column(Integer)
+    """Length of window in seconds."""
+    bucket = Column(Integer)
+    """Bucket slot."""
+    amount_count = Column(BigInteger)
+    """Total amount count for bucket in cents."""
+    trans_count = Column(Integer)
+    """Total number of transactions for bucket."""
+    epoch = Column(BigInteger)
+    """Bucket number of counts."""
+
+    def __init__(self, provider, window_seconds, bucket):
+        self.provider = provider
+        self.window_seconds = window_seconds
+        self.bucket = bucket
+        self.amount_count = 0
+        self.trans_count = 0
+        self.epoch = 0
+
+
+class JournalTable(Base):
+    """SQL transaction journal table. Each row is one transaction sent to a
+    gateway, card and account numbers are redacted. Phase times are
+    ``None`` for phases the transaction didn't reach."""
+    __tablename__ = JOURNAL_TABLE_NAME
+
+    id = Column(Integer, primary_key=True)
+    """Column ID (Primary Key)."""
+    created = Column(DateTime, nullable=False, index=True)
+    """UTC time the transaction was sent."""
+    provider = Column(String(64), nullable=False, index=True)
+    """Gateway provider."""
+    method = Column(String(16), nullable=False)
+    """Transaction method."""
+    amount = Column(BigInteger)
+    """Transaction amount in cents."""
+    transaction_id = Column(String(64), index=True)
+    """Gateway transaction ID."""
+    payment_account = Column(String(32))
+    """Redacted card or bank account number."""
+    outcome = Column(String(16), nullable=False)
+    """Outcome ``success``, ``decline`` or ``error``."""
+    reason_code = Column(String(16))
+    """Gateway response reason code."""
+    message = Column(String(255))
+    """Error message, redacted."""
+    latency = Column(Float, nullable=False)
+    """Seconds the gateway took."""
+    validation_time = Column(Float)
+    """Seconds spent validating the transaction."""
+    counter_time = Column(Float)
+    """Seconds spent checking and reserving counters."""
+    params_time = Column(Float)
+    """Seconds spent building request parameters."""
+    network_time = Column(Float)
+    """Seconds spent on the HTTP request."""
+    parse_time = Column(Float)
+    """Seconds spent parsing the response."""
+
+
+def connect_database(sql_connection, pool_pre_ping=False, create_tables=True,
+                     **engine_options):
+    """Connection to sql database. The connection is opened on first use of
+    a counter, if tables don't exists on database they will be created then.
 
     Arguments:
 
@@ -75,10 +314,75 @@ def connect_database(sql_connection):
         :widths: 7, 7, 40
 
         "*sql_connection*", "string", "SQL alchemy dialect url."
+        "*pool_pre_ping*", "bool", "Test pooled connections before they are
+        used and replace dead connections. Default is ``False``."
+        "*create_tables*", "bool", "Create tables that don't exist. Set to
+        ``False`` when the schema is managed separately. Default is
+        ``True``."
+        "*engine_options*", "dict", "Keyword arguments for the sql alchemy
+        engine such as `pool_size` and `pool_recycle`. Defaults are `40` and
+        `3600` except for sqlite."
+    """
+    global _engine, _sql_connection, _engine_options, _create_tables
+
+    with _engine_lock:
+        if _engine != None:
+            _engine.dispose()
+            _engine = None
+
+        _sql_connection = sql_connection
+        _engine_options = dict(engine_options, pool_pre_ping=pool_pre_ping)
+        _create_tables = create_tables
+        Session.remove()
+
+
+def migrate_database():
+    """Copy counters from the table used before version 2 of the schema to
+    the current counter table. Providers already in the current table are
+    skipped, the old table is left in place. Requires
+    :func:`connect_database`.
+
+    Returns:
+
+    Number of providers copied.
     """
-    engine = create_engine(sql_connection, pool_size=40, pool_recycle=3600)
-    Session.configure(bind=engine)
+    engine = get_engine()
+    connection = engine.connect()
+
+    try:
+        if not engine.dialect.has_table(connection, LEGACY_TABLE_NAME):
+            return 0
+
+        table = CounterTable.__table__
+        existing = set(row.provider for row in connection.execute(
+            table.select()))
+        copied = 0
+
+        with connection.begin():
+            for row in connection.execute(LegacyCounterTable.select()):
+                if row.provider in existing:
+                    continue
+
+                day = datetime.datetime.strptime(
+                        row.day_count_timestamp, '%Y%m%d').date()
+                month = datetime.datetime.strptime(
+                        row.month_count_timestamp, '%Y%m').date()
+
+                connection.execute(table.insert().values(
+                    provider=row.provider,
+                    shard=0,
+                    day_amount_count=int(round(
+                        (row.day_amount_count or 0) * 100)),
+                    month_amount_count=int(round(
+                        (row.month_amount_count or 0) * 100)),
+                    day_trans_count=row.day_trans_count or 0,
+                    month_trans_count=row.month_trans_count or 0,
+                    day=day.toordinal(),
+                    month=month.year * 12 + month.month - 1,
+                ))
+                existing.add(row.provider)
+                copied += 1
 
-    # If table doesnt exists create it
-    if engine.dialect.has_table(engine.connect(), TABLE_NAME) == False:
-        Base.metadata.create_all(engine)
+        return copied
+    finally:
+        connection.close()
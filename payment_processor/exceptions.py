@@ -53,12 +53,29 @@ class TransactionNotFound(GatewayError):
 class ConnectionError(GatewayError):
     """Unable to connect to gateway."""
 
+class GatewayTimeout(GatewayError):
+    """Gateway did not respond before the timeout. The request was sent so
+    the outcome of the transaction is unknown, a :attr:`MultiGateway` does
+    not try the next gateway."""
+
+class DeadlineExceeded(GatewayError):
+    """Transaction deadline was exceeded."""
+
 class LimitExceeded(GatewayError):
     """Transaction limit for gateway has been exceeded."""
 
 class CounterError(GatewayError):
     """An error occurred when handling counters."""
 
+class CircuitOpen(GatewayError):
+    """Gateway skipped because its circuit breaker is open."""
+
 
 class SQLEngineNotAviable(Exception):
     """Optional SQL engine is not aviable."""
+
+class SharedMemoryNotAviable(Exception):
+    """Optional shared memory counter is not aviable."""
+
+class RedisNotAviable(Exception):
+    """Optional redis client is not aviable."""
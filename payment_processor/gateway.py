@@ -1,13 +1,126 @@
 from payment_processor.exceptions import *
 from payment_processor.transaction import Transaction
+from payment_processor.circuit_breaker import CircuitBreaker
+from payment_processor.gateway_stats import GatewayStats
+from payment_processor.timing import *
+from payment_processor.metrics import SUCCESS, DECLINE, ERROR
+from requests.adapters import HTTPAdapter
+from multiprocessing.pool import ThreadPool
 import requests
+import threading
 import logging
+import random
+import time
 
 class BaseGateway( object ):
-    """Base gateway class."""
+    """Base gateway class. HTTP requests to the gateway are sent over a
+    keep-alive session so connections and their TLS sessions are reused
+    between transactions.
 
-    def __init__(self, trans_limit=None):
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*trans_limit*", "number", "Optional maximum amount of a single
+        transaction."
+        "*pool_connections*", "number", "Number of hosts to keep connection
+        pools for. Default is `10`."
+        "*pool_maxsize*", "number", "Maximum number of keep-alive connections
+        per host. Default is `10`."
+        "*pool_block*", "boolean", "Block when all connections to a host are
+        in use instead of opening a new one. Default is `False`."
+        "*async_workers*", "number", "Number of worker threads used to send
+        asynchronous transactions. Default is `10`."
+        "*connect_timeout*", "number", "Seconds to wait for a connection to
+        the gateway. Default is `10`."
+        "*read_timeout*", "number", "Seconds to wait for the gateway to
+        respond. Default is `120`."
+        "*metrics*", "class", "Optional :attr:`MetricsRegistry` to record
+        transaction metrics in."
+        "*journal*", "class", "Optional :attr:`TransactionJournal` to record
+        sent transactions in."
+    """
+    _trans_amount_limit = None
+    _pool_connections = 10
+    _pool_maxsize = 10
+    _pool_block = False
+    _async_workers = 10
+    _connect_timeout = 10
+    _read_timeout = 120
+    _session = None
+    _session_lock = threading.Lock()
+    _timing_handlers = None
+    _metrics = None
+    _journal = None
+    _async_pool = None
+    _async_pool_lock = threading.Lock()
+
+    def __init__(self, trans_limit=None, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, async_workers=10, connect_timeout=10,
+                 read_timeout=120, metrics=None, journal=None):
         self._trans_amount_limit = trans_limit
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._pool_block = pool_block
+        self._async_workers = async_workers
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._metrics = metrics
+        self._journal = journal
+
+    def _get_session(self):
+        """Get the HTTP session for the gateway. The session is created on
+        first use and shared by all transactions sent with this gateway.
+
+        Returns:
+
+        Instance of :attr:`requests.Session`.
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    adapter = HTTPAdapter(
+                        pool_connections=self._pool_connections,
+                        pool_maxsize=self._pool_maxsize,
+                        pool_block=self._pool_block)
+
+                    session = requests.Session()
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+
+        return self._session
+
+    def _get_async_pool(self):
+        """Get the worker thread pool used for asynchronous transactions. The
+        pool is created on first use.
+
+        Returns:
+
+        Instance of :attr:`multiprocessing.pool.ThreadPool`.
+        """
+        if self._async_pool is None:
+            with self._async_pool_lock:
+                if self._async_pool is None:
+                    self._async_pool = ThreadPool(self._async_workers)
+
+        return self._async_pool
+
+    def close(self):
+        """Close the gateway HTTP session and any pooled connections. Stops
+        the asynchronous worker threads after pending transactions finish."""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+        with self._async_pool_lock:
+            if self._async_pool is not None:
+                self._async_pool.close()
+                self._async_pool.join()
+                self._async_pool = None
 
     def _send(self, transaction, data, **kwargs):
         """Send transaction data with HTTP request to gateway.
@@ -26,22 +139,92 @@ class BaseGateway( object ):
 
         Response from gateway.
         """
+        timer = transaction._timer
+        if timer != None:
+            timer.mark(PARAMS)
+
+        # Only pass deadline timeouts so send request methods without a
+        # timeout argument keep working
+        request_kwargs = dict(kwargs)
+        if transaction._deadline != None:
+            request_kwargs['timeout'] = self._get_timeout(transaction)
+
         # Send request
+        transaction._requests += 1
         try:
-            response = self._send_request(transaction, data, **kwargs)
+            response = self._send_request(transaction, data,
+                                          **request_kwargs)
+        except requests.exceptions.Timeout, exception:
+            # Timeout was limited by the deadline, the gateway isn't at fault
+            if (transaction._deadline != None and
+                    time.time() >= transaction._deadline):
+                raise DeadlineExceeded('Transaction deadline exceeded.')
+
+            # Nothing was sent if the connection timed out
+            if isinstance(exception, requests.exceptions.ConnectTimeout):
+                raise ConnectionError('Timed out connecting to %r.' %
+                                      self._url)
+            raise GatewayTimeout('Request to %r timed out.' % self._url)
         except requests.exceptions.ConnectionError:
             raise ConnectionError('Failed to connect to %r.' % self._url)
+        finally:
+            if timer != None:
+                timer.mark(NETWORK)
 
         # Check status code
         if response.status_code < 200 or response.status_code > 202:
             raise ConnectionError(('Gateway returned unsuccessful ' +
                 'HTTP status code %r.') % (response.status_code))
 
-        return self._handle_response(transaction, response.text, **kwargs)
+        try:
+            return self._handle_response(transaction, response.text,
+                                         **kwargs)
+        finally:
+            if timer != None:
+                timer.mark(PARSE)
+
+    def _get_timeout(self, transaction):
+        """Get the connect and read timeouts for a request. If the
+        transaction has a deadline the timeouts are limited to the time
+        remaining.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*transaction*", "class", "Instance of :attr:`Transaction`."
+
+        Returns:
+
+        Tuple containing `connect_timeout` and `read_timeout`.
+
+        Raises:
+
+        :attr:`DeadlineExceeded` If the transaction deadline has passed.
+        """
+        if transaction._deadline == None:
+            return (self._connect_timeout, self._read_timeout)
+
+        remaining = transaction._deadline - time.time()
+        if remaining <= 0:
+            raise DeadlineExceeded('Transaction deadline exceeded.')
+
+        connect_timeout = remaining
+        if self._connect_timeout != None:
+            connect_timeout = min(self._connect_timeout, remaining)
+
+        read_timeout = remaining
+        if self._read_timeout != None:
+            read_timeout = min(self._read_timeout, remaining)
+
+        return (connect_timeout, read_timeout)
 
     def _send_request(self):
         """Override with method to send request to gateway. Must return
-        response object."""
+        response object. Requests must use the timeout argument, if it is
+        ``None`` the timeouts from :attr:`_get_timeout` are used."""
         raise TypeError('Send request method not implemented for gatewy.')
 
     def _payment_method_validator(self, transaction):
@@ -106,7 +289,7 @@ class BaseGateway( object ):
     def _status_validator(self, transaction):
         self._transaction_id_validator(transaction)
 
-    def _send_transaction(self, transaction, method_name):
+    def _send_transaction(self, transaction, method_name, deadline=None):
         """Send a transaction method by name.
 
         Arguments
@@ -116,22 +299,292 @@ class BaseGateway( object ):
             :widths: 7, 7, 40
 
             "*method_name*", "string", "Name of transaction method."
+            "*deadline*", "number", "Optional seconds the transaction may
+            take."
 
         Returns:
 
         Data returned from transaction method.
         """
+        # Set deadline on transaction for the duration of the send
+        if deadline != None:
+            transaction._deadline = time.time() + deadline
+            try:
+                return self._send_transaction(transaction, method_name)
+            finally:
+                transaction._deadline = None
+
+        # Time transaction if a timing handler is registered or the
+        # journal records phase times
+        if ((self._timing_handlers or self._journal != None) and
+                transaction._timer == None):
+            return self._send_timed_transaction(transaction, method_name)
+
         # Check transaction for valid variables
         if hasattr(self, method_name + '_validator'):
             getattr(self, method_name + '_validator')(transaction)
 
+        if transaction._timer != None:
+            transaction._timer.mark(VALIDATION)
+
         # Check limit
         if (transaction.amount > self._trans_amount_limit and
                 self._trans_amount_limit != None):
             raise LimitExceeded('Transaction limit exceeded.')
 
         method = getattr(self, method_name)
-        return method(transaction)
+        if self._metrics == None and self._journal == None:
+            return method(transaction)
+
+        start_time = time.time()
+        try:
+            response = method(transaction)
+        except TransactionError, exception:
+            self._observe(transaction, method_name, start_time, DECLINE,
+                          exception)
+            raise
+        except Exception, exception:
+            self._observe(transaction, method_name, start_time, ERROR,
+                          exception)
+            raise
+
+        self._observe(transaction, method_name, start_time, SUCCESS)
+        return response
+
+    def _observe(self, transaction, method_name, start_time, outcome,
+                 exception=None):
+        """Record a sent transaction in the metrics registry and journal.
+        Errors are logged so they never change the result of the
+        transaction.
+
+        Arguments
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*method_name*", "string", "Name of transaction method."
+            "*start_time*", "number", "Unix time the transaction was sent."
+            "*outcome*", "string", ":attr:`SUCCESS`, :attr:`DECLINE` or
+            :attr:`ERROR`."
+            "*exception*", "object", "Exception raised by the transaction."
+        """
+        if self._metrics != None:
+            try:
+                self._metrics.observe(self.provider, method_name,
+                                      time.time() - start_time, outcome)
+            except Exception:
+                logging.exception('Failed to record transaction metrics.')
+
+        if self._journal != None:
+            try:
+                self._journal.record(self.provider, method_name, transaction,
+                                     start_time, outcome, exception)
+            except Exception:
+                logging.exception('Failed to record transaction journal.')
+
+    def _send_timed_transaction(self, transaction, method_name):
+        """Send a transaction method by name recording phase timings. The
+        timings are added to `transaction.response_info` and passed to the
+        timing handlers.
+
+        Arguments
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*method_name*", "string", "Name of transaction method."
+
+        Returns:
+
+        Data returned from transaction method.
+        """
+        timer = PhaseTimer()
+        transaction._timer = timer
+
+        try:
+            return self._send_transaction(transaction, method_name)
+        finally:
+            transaction._timer = None
+            timings = timer.get_timings()
+            transaction.response_info['timings'] = timings
+
+            for handler in self._timing_handlers or ():
+                handler( transaction, method_name, timings )
+
+    def on_timing( self, handler ):
+        """Add a handler called with the transaction, method name and
+        timings after each transaction is sent. Timings are a dictonary
+        containing the `total` seconds, seconds spent in each of the
+        `phases` and the `attempts` made by a :attr:`MultiGateway`.
+        Transactions are only timed while a handler is registered."""
+        if self._timing_handlers == None:
+            self._timing_handlers = []
+        self._timing_handlers.append( handler )
+        return handler
+
+    def _send_transaction_async(self, transaction, method_name,
+                                callback=None, deadline=None):
+        """Send a transaction method by name without blocking. The
+        transaction is sent from the gateway worker thread pool.
+
+        Arguments
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*method_name*", "string", "Name of transaction method."
+            "*callback*", "function", "Optional function called with the
+            data returned from the transaction method on success. Exceptions
+            raised by the callback are logged."
+            "*deadline*", "number", "Optional seconds the transaction may
+            take once it is sent."
+
+        Returns:
+
+        Instance of :attr:`multiprocessing.pool.AsyncResult`. Calling
+        ``get()`` waits for and returns the data from the transaction method
+        or raises the transaction exception.
+        """
+        if callback != None:
+            user_callback = callback
+
+            # An exception in the callback would stop the pool result thread
+            def callback(response):
+                try:
+                    user_callback(response)
+                except Exception:
+                    logging.exception('Transaction callback failed.')
+
+        return self._get_async_pool().apply_async(self._send_transaction,
+            (transaction, method_name, deadline), callback=callback)
+
+    def _send_transactions(self, transactions, method_name, concurrency,
+                           deadline=None):
+        """Send a transaction method by name for many transactions using a
+        pool of worker threads. A failed transaction does not stop the
+        other transactions from being sent.
+
+        Arguments
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*transactions*", "list", "Instances of :attr:`Transaction`."
+            "*method_name*", "string", "Name of transaction method."
+            "*concurrency*", "number", "Number of transactions to send at
+            once."
+            "*deadline*", "number", "Optional seconds each transaction may
+            take."
+
+        Returns:
+
+        Generator of the data returned from the transaction method or the
+        exception raised for each transaction, in the same order as
+        `transactions`.
+        """
+        def send(transaction):
+            try:
+                return self._send_transaction(transaction, method_name,
+                                              deadline)
+            except Exception, exception:
+                return exception
+
+        pool = ThreadPool(concurrency)
+        try:
+            for result in pool.imap(send, transactions):
+                yield result
+        finally:
+            # Transactions not yet started are dropped if the generator is
+            # closed early
+            pool.terminate()
+
+    def charge_many(self, transactions, concurrency=10, deadline=None):
+        """Authorize and capture many transactions at once. See
+        :attr:`_send_transactions`.
+
+        Returns:
+
+        Generator of transaction IDs or exceptions in the order of
+        `transactions`.
+        """
+        return self._send_transactions(transactions, '_charge', concurrency,
+            deadline)
+
+    def authorize_many(self, transactions, concurrency=10, deadline=None):
+        """Authorize many transactions at once. See
+        :attr:`_send_transactions`.
+
+        Returns:
+
+        Generator of transaction IDs or exceptions in the order of
+        `transactions`.
+        """
+        return self._send_transactions(transactions, '_authorize', concurrency,
+            deadline)
+
+    def capture_many(self, transactions, concurrency=10, deadline=None):
+        """Capture many transactions at once. See
+        :attr:`_send_transactions`.
+
+        Returns:
+
+        Generator of transaction IDs or exceptions in the order of
+        `transactions`.
+        """
+        return self._send_transactions(transactions, '_capture', concurrency,
+            deadline)
+
+    def refund_many(self, transactions, concurrency=10, deadline=None):
+        """Refund many transactions at once. See
+        :attr:`_send_transactions`.
+
+        Returns:
+
+        Generator of transaction IDs or exceptions in the order of
+        `transactions`.
+        """
+        return self._send_transactions(transactions, '_refund', concurrency,
+            deadline)
+
+    def credit_many(self, transactions, concurrency=10, deadline=None):
+        """Credit many transactions at once. See
+        :attr:`_send_transactions`.
+
+        Returns:
+
+        Generator of transaction IDs or exceptions in the order of
+        `transactions`.
+        """
+        return self._send_transactions(transactions, '_credit', concurrency,
+            deadline)
+
+    def void_many(self, transactions, concurrency=10, deadline=None):
+        """Void many transactions at once. See
+        :attr:`_send_transactions`.
+
+        Returns:
+
+        Generator of transaction IDs or exceptions in the order of
+        `transactions`.
+        """
+        return self._send_transactions(transactions, '_void', concurrency,
+            deadline)
+
+    def status_many(self, transactions, concurrency=10, deadline=None):
+        """Get the status of many transactions at once. See
+        :attr:`_send_transactions`.
+
+        Returns:
+
+        Generator of transaction IDs or exceptions in the order of
+        `transactions`.
+        """
+        return self._send_transactions(transactions, '_status', concurrency,
+            deadline)
 
     def new_transaction(self):
         """Create a new transaction.
@@ -146,7 +599,28 @@ class BaseGateway( object ):
 
 class MultiGateway(BaseGateway):
     """Multi gateway class. Allows multiple gateways to be used, in the event
-    that one gateway fails the next one will be used.
+    that one gateway fails the next one will be used. Asynchronous
+    transactions run the whole failover loop in the multi gateway worker
+    thread pool.
+
+    When a failure threshold is given each gateway gets a
+    :attr:`CircuitBreaker`, gateways with an open breaker are skipped
+    without being tried.
+
+    Only gateways that failed before the request reached them are followed
+    by the next gateway. A :attr:`GatewayTimeout` is raised to the caller
+    as the timed out gateway may have processed the transaction.
+
+    With latency routing the gateways are ordered by their live
+    :attr:`GatewayStats`. Healthy gateways are tried fastest first, a share
+    of transactions is sent to a random other gateway first to keep its
+    stats fresh.
+
+    A metrics registry given to the multi gateway records each gateway
+    attempt and failover under the provider of the gateway tried. Give a
+    registry to the multi gateway or to its gateways, not both, or attempts
+    are counted twice. Journals are given to each gateway, not to the multi
+    gateway.
 
     Arguments:
 
@@ -155,17 +629,102 @@ class MultiGateway(BaseGateway):
         :widths: 7, 7, 40
 
         "*args*", "class", "Instance of gateways to use."
+        "*failure_threshold*", "number", "Optional number of consecutive
+        connection failures before a gateway is skipped. Default is `None`
+        which disables circuit breakers."
+        "*recovery_timeout*", "number", "Seconds before a skipped gateway
+        is tried again. Default is `30`."
+        "*min_attempt_time*", "number", "Minimum seconds left before the
+        transaction deadline required to try the next gateway. Default is
+        `0`."
+        "*latency_routing*", "boolean", "Order gateways by live response
+        time instead of the order given. Default is `False`."
+        "*explore_ratio*", "number", "Share of transactions sent to a
+        gateway other than the fastest first. Default is `0.05`."
+        "*min_success_rate*", "number", "Gateways with a lower success rate
+        are tried last. Default is `0.5`."
+        "*stats_alpha*", "number", "Weight of the newest sample in gateway
+        stats. Default is `0.2`."
     """
     gateways = None
     _gateway_failure_handlers = None
+    _circuit_breakers = None
+    _gateway_stats = None
+    _min_attempt_time = 0
+    _explore_ratio = 0.05
+    _min_success_rate = 0.5
+
+    def __init__(self, *gateways, **kwargs):
+        failure_threshold = kwargs.pop('failure_threshold', None)
+        recovery_timeout = kwargs.pop('recovery_timeout', 30)
+        latency_routing = kwargs.pop('latency_routing', False)
+        stats_alpha = kwargs.pop('stats_alpha', 0.2)
+        self._min_attempt_time = kwargs.pop('min_attempt_time', 0)
+        self._explore_ratio = kwargs.pop('explore_ratio', 0.05)
+        self._min_success_rate = kwargs.pop('min_success_rate', 0.5)
+        if kwargs.get('journal') != None:
+            raise TypeError('Journal is not supported by multi gateway, ' +
+                            'give the journal to each gateway.')
+        BaseGateway.__init__(self, **kwargs)
 
-    def __init__(self, *gateways):
         self.gateways = gateways
         self._gateway_failure_handlers = []
+        self._circuit_breakers = {}
+        self._gateway_stats = {}
+
+        if failure_threshold != None:
+            for gateway in gateways:
+                self._circuit_breakers[gateway] = CircuitBreaker(
+                    failure_threshold, recovery_timeout)
 
-    def _send_transaction(self, transaction, method_name):
+        if latency_routing:
+            for gateway in gateways:
+                self._gateway_stats[gateway] = GatewayStats(stats_alpha)
+
+    def _get_gateway_order(self):
+        """Get the order gateways should be tried in. Without latency
+        routing this is the order the gateways were given.
+
+        Returns:
+
+        List of gateways.
+        """
+        if not self._gateway_stats:
+            return self.gateways
+
+        healthy = []
+        unhealthy = []
+        for gateway in self.gateways:
+            if (self._gateway_stats[gateway].success_rate >=
+                    self._min_success_rate):
+                healthy.append(gateway)
+            else:
+                unhealthy.append(gateway)
+
+        # Gateways without stats sort first so they get measured, gateways
+        # that failed without ever responding sort last
+        def get_latency(gateway):
+            stats = self._gateway_stats[gateway]
+            if stats.latency != None:
+                return stats.latency
+            elif stats.request_count == 0:
+                return 0
+            return float('inf')
+
+        healthy.sort(key=get_latency)
+        gateways = healthy + unhealthy
+
+        # Send some traffic to another gateway first to keep stats fresh
+        if len(gateways) > 1 and random.random() < self._explore_ratio:
+            gateway = gateways.pop(random.randint(1, len(gateways) - 1))
+            gateways.insert(0, gateway)
+
+        return gateways
+
+    def _send_transaction(self, transaction, method_name, deadline=None):
         """Send a transaction method by name. If a gateway fails the next
-        aviable gateway will be tried.
+        aviable gateway will be tried while time remains before the
+        deadline.
 
         Arguments:
 
@@ -174,32 +733,136 @@ class MultiGateway(BaseGateway):
             :widths: 7, 7, 40
 
             "*method_name*", "string", "Name of transaction method."
+            "*deadline*", "number", "Optional seconds the transaction may
+            take including all gateway attempts."
 
         Returns:
 
         Data returned from transaction method.
+
+        Raises:
+
+        :attr:`DeadlineExceeded` If the deadline passed before a gateway
+        succeeded.
         """
+        # Set deadline on transaction for the duration of the send
+        if deadline != None:
+            transaction._deadline = time.time() + deadline
+            try:
+                return self._send_transaction(transaction, method_name)
+            finally:
+                transaction._deadline = None
+
+        # Time transaction if a timing handler is registered
+        if self._timing_handlers and transaction._timer == None:
+            return self._send_timed_transaction(transaction, method_name)
+
+        timer = transaction._timer
         last_exception = None
 
-        for gateway in self.gateways:
+        for gateway in self._get_gateway_order():
+            # Stop if not enough time remains to try another gateway
+            if (transaction._deadline != None and
+                    transaction._deadline - time.time() <=
+                    self._min_attempt_time):
+                raise DeadlineExceeded('Transaction deadline exceeded. ' +
+                    'Last exception: %r' % last_exception)
+
             # If an error occurred on previous gateway log error
             if last_exception != None:
                 logging.warning('Recvied gateway error trying next ' +
                     'gateway. Exception: %r', last_exception)
 
+            # Skip gateway if circuit breaker is open
+            breaker = self._circuit_breakers.get(gateway)
+            if breaker != None and not breaker.allow_request():
+                last_exception = CircuitOpen(
+                    'Circuit breaker open for %r.' % gateway.provider)
+
+                if self._metrics != None:
+                    self._metrics.record_failover(gateway.provider,
+                                                  method_name)
+
+                for handler in self._gateway_failure_handlers:
+                    handler( last_exception, gateway, transaction, method_name )
+                continue
+
+            stats = self._gateway_stats.get(gateway)
+            sent_requests = transaction._requests
+            start_time = time.time()
+            if timer != None:
+                start_time = timer.start_attempt()
+
             try:
                 response = gateway._send_transaction( transaction, method_name )
-                # The transaction was successful with this gateway so lets
-                # change the transaction's gateway to be the one that processed
-                # it successfully
-                transaction.gateway = gateway
-                return response
-            except GatewayError, exception:
+            except Exception, exception:
+                if timer != None:
+                    timer.end_attempt(gateway, start_time, exception)
+
+                self._observe_attempt(gateway, method_name, start_time,
+                                      exception)
+
+                # Limit and deadline errors don't reflect gateway speed and
+                # connection failures only count against the success rate
+                if (stats != None and
+                        transaction._requests != sent_requests and
+                        not isinstance(exception,
+                        (DeadlineExceeded, LimitExceeded))):
+                    if isinstance(exception, ConnectionError):
+                        stats.record(None, False)
+                    elif isinstance(exception, GatewayTimeout):
+                        stats.record(time.time() - start_time, False)
+                    else:
+                        stats.record(time.time() - start_time, True)
+
+                # Only connection failures and timeouts count against the
+                # breaker, any other response shows the gateway is up. Errors
+                # raised before a request was sent say nothing about the
+                # gateway.
+                if breaker != None:
+                    if isinstance(exception,
+                            (ConnectionError, GatewayTimeout)):
+                        breaker.record_failure()
+                    elif (isinstance(exception, DeadlineExceeded) or
+                            transaction._requests == sent_requests):
+                        breaker.release()
+                    else:
+                        breaker.record_success()
+
+                # The outcome is unknown after a timeout, trying the next
+                # gateway could process the transaction twice
+                if (not isinstance(exception, GatewayError) or
+                        isinstance(exception,
+                        (DeadlineExceeded, GatewayTimeout))):
+                    raise
+
                 # Gateway error try next gateway
                 last_exception = exception
 
+                if self._metrics != None:
+                    self._metrics.record_failover(gateway.provider,
+                                                  method_name)
+
                 for handler in self._gateway_failure_handlers:
                     handler( exception, gateway, transaction, method_name )
+                continue
+
+            if timer != None:
+                timer.end_attempt(gateway, start_time)
+
+            self._observe_attempt(gateway, method_name, start_time)
+
+            if stats != None:
+                stats.record(time.time() - start_time, True)
+
+            if breaker != None:
+                breaker.record_success()
+
+            # The transaction was successful with this gateway so lets
+            # change the transaction's gateway to be the one that processed
+            # it successfully
+            transaction.gateway = gateway
+            return response
 
         # All gateways failed raise last exception
         if last_exception != None:
@@ -207,6 +870,95 @@ class MultiGateway(BaseGateway):
         else:
             raise TypeError('Gateway list is empty.')
 
+    def _observe_attempt(self, gateway, method_name, start_time,
+                         exception=None):
+        """Record a gateway attempt in the metrics registry under the provider
+        of the gateway tried. Errors are logged so they never change the
+        result of the transaction.
+
+        Arguments
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*gateway*", "class", "Gateway instance that was tried."
+            "*method_name*", "string", "Name of transaction method."
+            "*start_time*", "number", "Unix time the attempt started."
+            "*exception*", "object", "Exception raised by the attempt."
+        """
+        if self._metrics == None:
+            return
+
+        if exception == None:
+            outcome = SUCCESS
+        elif isinstance(exception, TransactionError):
+            outcome = DECLINE
+        else:
+            outcome = ERROR
+
+        try:
+            self._metrics.observe(gateway.provider, method_name,
+                                  time.time() - start_time, outcome)
+        except Exception:
+            logging.exception('Failed to record transaction metrics.')
+
+    def get_circuit_breaker(self, gateway):
+        """Get the circuit breaker of a gateway.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*gateway*", "class", "Gateway instance."
+
+        Returns:
+
+        Instance of :attr:`CircuitBreaker` or ``None`` if circuit breakers
+        are disabled.
+        """
+        return self._circuit_breakers.get(gateway)
+
+    def get_gateway_stats(self, gateway):
+        """Get the live stats of a gateway.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*gateway*", "class", "Gateway instance."
+
+        Returns:
+
+        Instance of :attr:`GatewayStats` or ``None`` if latency routing is
+        disabled.
+        """
+        return self._gateway_stats.get(gateway)
+
+    def close(self):
+        """Close the HTTP sessions of all gateways and stop the asynchronous
+        worker threads."""
+        BaseGateway.close(self)
+
+        for gateway in self.gateways:
+            gateway.close()
+
     def on_gateway_failure( self, handler ):
+        """Add a handler called with the exception, gateway, transaction and
+        method name when a gateway fails. Gateways skipped by an open circuit
+        breaker are reported with a :attr:`CircuitOpen` exception."""
         self._gateway_failure_handlers.append( handler )
         return handler
+
+    def on_circuit_change( self, handler ):
+        """Add a handler called with the gateway, previous state and new
+        state when a gateway circuit breaker changes state."""
+        for gateway, breaker in self._circuit_breakers.items():
+            breaker.on_state_change(
+                lambda breaker, previous_state, state, gateway=gateway:
+                    handler( gateway, previous_state, state ))
+        return handler
@@ -0,0 +1,54 @@
+import threading
+
+class GatewayStats(object):
+    """Live gateway statistics. Tracks an exponentially weighted moving
+    average of the gateway response time and success rate.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*alpha*", "number", "Weight of the newest sample between `0` and
+        `1`. Default is `0.2`."
+    """
+    alpha = None
+    """Weight of the newest sample."""
+    latency = None
+    """Average response time in seconds, ``None`` until a response is
+    recorded."""
+    success_rate = 1.0
+    """Average rate of requests that were not connection failures."""
+    request_count = 0
+    """Number of requests recorded."""
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def record(self, latency, success):
+        """Record a gateway request.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*latency*", "number", "Response time in seconds or ``None`` if
+            the gateway didn't respond."
+            "*success*", "boolean", "``False`` if the request failed to
+            reach the gateway."
+        """
+        with self._lock:
+            if latency == None:
+                pass
+            elif self.latency == None:
+                self.latency = latency
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+
+            self.success_rate += self.alpha * (
+                (1.0 if success else 0.0) - self.success_rate)
+            self.request_count += 1
@@ -1,7 +1,6 @@
 from payment_processor.exceptions import *
 from payment_processor.constants import *
 from payment_processor.gateway import BaseGateway
-import requests
 import xml.dom.minidom
 import datetime
 
@@ -17,11 +16,15 @@ class AuthorizeNetAIM(BaseGateway):
         "*login*", "string", "Login."
         "*trans_key*", "string", "Transaction key."
         "*sandbox*", "boolean", "Optional sandbox mode. Default is `False`."
+        "*base_url*", "string", "Optional url to send requests to instead
+        of Authorize.Net such as a
+        :attr:`payment_processor.stand_in.StandInServer`."
     """
     provider = 'authorize_net'
 
     def __init__(self, login, trans_key, sandbox=False, test_requests=False,
                  *args, **kwargs):
+        base_url = kwargs.pop('base_url', None)
         BaseGateway.__init__(self, *args, **kwargs)
 
         self._login = login
@@ -31,7 +34,10 @@ class AuthorizeNetAIM(BaseGateway):
         self._delim_char = '|'
 
         # Set url
-        if sandbox:
+        if base_url != None:
+            self._url = base_url + '/gateway/transact.dll'
+            self._report_url = base_url + '/xml/v1/request.api'
+        elif sandbox:
             self._url = 'https://test.authorize.net/gateway/transact.dll'
             self._report_url = 'https://apitest.authorize.net/' + \
                 'xml/v1/request.api'
@@ -189,7 +195,7 @@ class AuthorizeNetAIM(BaseGateway):
 
         return data
 
-    def _send_request(self, transaction, data, type='delim'):
+    def _send_request(self, transaction, data, timeout=None, type='delim'):
         """Send request to gateway.
 
         Arguments:
@@ -202,22 +208,29 @@ class AuthorizeNetAIM(BaseGateway):
                 containing required transaction info."
             "*data*", "dict", "Dictonary of HTTP parameters to send or
             string containing XML data."
+            "*timeout*", "tuple", "Connect and read timeout in seconds.
+            Default is the gateway timeouts."
             "*type*", "string", "Request type."
 
         Returns:
 
         Response object.
         """
+        if timeout == None:
+            timeout = self._get_timeout(transaction)
+
         if type == 'delim':
             # Add custom fields to params
             data = dict(data.items() + transaction._custom_fields.items())
 
-            return requests.get(self._url, params=data)
+            return self._get_session().get(self._url, params=data,
+                timeout=timeout)
 
         elif type == 'xml':
             headers = {'content-type': 'text/xml'}
 
-            return requests.post(self._report_url, headers=headers, data=data)
+            return self._get_session().post(self._report_url, headers=headers,
+                data=data, timeout=timeout)
 
         else:
             raise TypeError('Invalid response type %r.' % type)
@@ -1,7 +1,6 @@
 from payment_processor.exceptions import *
 from payment_processor.gateway import BaseGateway
 import urlparse
-import requests
 
 class NationalProcessing(BaseGateway):
     """National Processing gateway.
@@ -14,16 +13,23 @@ class NationalProcessing(BaseGateway):
 
         "*username*", "string", "Username."
         "*password*", "string", "Password."
+        "*base_url*", "string", "Optional url to send requests to instead
+        of National Processing such as a
+        :attr:`payment_processor.stand_in.StandInServer`."
     """
     provider = 'national_processing'
 
     def __init__(self, username, password, *args, **kwargs):
+        base_url = kwargs.pop('base_url', None)
         BaseGateway.__init__(self, *args, **kwargs)
 
         self._username = username
         self._password = password
-        self._url = 'https://secure.nationalprocessinggateway.com/' + \
-                     'api/transact.php'
+        if base_url != None:
+            self._url = base_url + '/api/transact.php'
+        else:
+            self._url = 'https://secure.nationalprocessinggateway.com/' + \
+                         'api/transact.php'
 
     def _get_params(self, transaction):
         """Get the HTTP parameters for the gateway using the transaction.
@@ -122,7 +128,7 @@ class NationalProcessing(BaseGateway):
 
         return params
 
-    def _send_request(self, transaction, data):
+    def _send_request(self, transaction, data, timeout=None):
         """Send request to gateway.
 
         Arguments:
@@ -134,15 +140,21 @@ class NationalProcessing(BaseGateway):
             "*transaction*", "class", "Instance of :attr:`Transaction`
                 containing required transaction info."
             "*data*", "dict", "Dictonary of HTTP parameters to send."
+            "*timeout*", "tuple", "Connect and read timeout in seconds.
+            Default is the gateway timeouts."
 
         Returns:
 
         Response object.
         """
+        if timeout == None:
+            timeout = self._get_timeout(transaction)
+
         # Add custom fields to params
         data = dict(data.items() + transaction._custom_fields.items())
 
-        return requests.get(self._url, params=data)
+        return self._get_session().get(self._url, params=data,
+            timeout=timeout)
 
     def _handle_response(self, transaction, response):
         """Handles HTTP response from gateway.
@@ -197,6 +209,13 @@ class NationalProcessing(BaseGateway):
         except KeyError:
             avs_response = None
 
+        transaction.response_info = dict(
+            description=response_text,
+            avs_response=avs_response,
+            response_code=response_num,
+            reason_code=response_code
+        )
+
         # Check response code
         if response_num == 1:
             return transaction_id
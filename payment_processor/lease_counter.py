@@ -0,0 +1,270 @@
+from payment_processor.exceptions import *
+from payment_processor.counter import CounterReservation, period_clock
+import atexit
+import logging
+import threading
+import time
+
+SWEEP_INTERVAL = 5
+"""Seconds between checks for idle leases."""
+
+class CounterLease(object):
+    """Block of counter headroom claimed from a backing counter.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*counter*", "object", "Counter the lease was claimed with."
+        "*amount*", "number", "Claimed amount."
+        "*trans*", "number", "Claimed number of transactions."
+        "*day*", "number", "Day period of the claim."
+        "*month*", "number", "Month period of the claim."
+    """
+    counter = None
+    """Counter the lease was claimed with, used to return unused
+    headroom."""
+    amount = None
+    """Unused amount."""
+    trans = None
+    """Unused number of transactions."""
+    day = None
+    """Day period of the claim."""
+    month = None
+    """Month period of the claim."""
+    last_used = None
+    """Time the lease was last used."""
+
+    def __init__(self, counter, amount, trans, day, month):
+        self.counter = counter
+        self.amount = amount
+        self.trans = trans
+        self.day = day
+        self.month = month
+        self.last_used = time.time()
+
+
+class LeaseReservation(CounterReservation):
+    """Counts reserved from a :attr:`CounterLease`."""
+    lease = None
+    """Lease the counts were reserved from."""
+
+    def __init__(self, counter, amount, trans, lease):
+        CounterReservation.__init__(self, counter, amount, trans,
+                                    lease.day, lease.month)
+        self.lease = lease
+
+
+class LeaseState(object):
+    """Lease of one gateway provider shared by all leased counters of the
+    provider in the process.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*gateway_counter*", "class", "Backing counter class."
+        "*idle_timeout*", "number", "Seconds before an unused lease is
+        returned."
+    """
+    lease = None
+    """Current :attr:`CounterLease` or ``None``."""
+    claim_retry_time = 0
+    """Time before which no new lease is claimed."""
+
+    def __init__(self, gateway_counter, idle_timeout):
+        self.lock = threading.Lock()
+        self.gateway_counter = gateway_counter
+        self.idle_timeout = idle_timeout
+
+    def _return_lease(self):
+        """Return unused headroom of lease. Must be called with lock
+        held."""
+        lease = self.lease
+        self.lease = None
+
+        if lease.amount > 0 or lease.trans > 0:
+            self.gateway_counter._release_reservation(lease.counter,
+                CounterReservation(lease.counter, lease.amount, lease.trans,
+                                   lease.day, lease.month))
+
+    def return_idle_lease(self):
+        """Return lease if it has been idle longer than idle timeout."""
+        with self.lock:
+            if (self.lease != None and
+                    time.time() - self.lease.last_used >= self.idle_timeout):
+                self._return_lease()
+
+    def return_lease(self):
+        """Return unused headroom to the backing counter."""
+        with self.lock:
+            if self.lease != None:
+                self._return_lease()
+
+
+_lease_states = []
+_lease_states_lock = threading.Lock()
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def _sweep():
+    """Return idle leases of all gateway providers."""
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        for lease_state in list(_lease_states):
+            try:
+                lease_state.return_idle_lease()
+            except Exception:
+                logging.exception('Failed to return idle counter lease.')
+
+
+def _start_sweeper():
+    """Start idle lease sweeper thread if not running."""
+    global _sweeper
+
+    if _sweeper != None:
+        return
+
+    with _sweeper_lock:
+        if _sweeper == None:
+            _sweeper = threading.Thread(target=_sweep)
+            _sweeper.daemon = True
+            _sweeper.start()
+
+
+@atexit.register
+def _return_leases():
+    """Return unused headroom of all gateway providers on shutdown."""
+    for lease_state in list(_lease_states):
+        try:
+            lease_state.return_lease()
+        except Exception:
+            logging.exception('Failed to return counter lease.')
+
+
+def leased_counter(gateway_counter, amount_block, trans_block,
+                   idle_timeout=60):
+    """Creates a counter that claims blocks of headroom from the given
+    counter and spends them locally. Only one backing counter call is made
+    for each block. One lease is kept for each gateway provider in the
+    process and shared by all counters of the provider. Unused headroom is
+    returned when the block can't fit a transaction, after the lease is idle
+    and on shutdown.
+
+    Headroom held by other processes counts against the limits, so near a
+    limit transactions may be refused early by up to one block for each
+    process. When a full block doesn't fit the counts of the transaction are
+    reserved directly, limits are never exceeded. No blocks are claimed
+    until idle timeout has passed after a failed claim. Counts of the backing
+    counter include the unused headroom of leases. Window limits are not
+    supported.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*gateway_counter*", "class", "Counter class."
+        "*amount_block*", "number", "Amount claimed with each lease."
+        "*trans_block*", "number", "Number of transactions claimed with each
+        lease."
+        "*idle_timeout*", "number", "Seconds before an unused lease is
+        returned. Default is `60`."
+
+    Returns:
+
+    Counter class.
+
+    Usage::
+
+        import payment_processor
+
+        payment_processor.connect_database('sqlite:///counters.db')
+
+        AuthorizeNetAIMCounted = payment_processor.counted_gateway(
+            payment_processor.AuthorizeNetAIM,
+            payment_processor.leased_counter(
+                payment_processor.SQLGatewayCounter,
+                amount_block=1000, trans_block=50))
+    """
+    lease_states = {}
+
+    class LeasedCounter(gateway_counter):
+        _window_limits_supported = False
+        _lease_state = None
+
+        def __init__(self, *args, **kwargs):
+            gateway_counter.__init__(self, *args, **kwargs)
+
+            with _lease_states_lock:
+                self._lease_state = lease_states.get(self.provider)
+                if self._lease_state == None:
+                    self._lease_state = LeaseState(gateway_counter,
+                                                   idle_timeout)
+                    lease_states[self.provider] = self._lease_state
+                    _lease_states.append(self._lease_state)
+
+            _start_sweeper()
+
+        def return_lease(self):
+            """Return unused headroom to the backing counter."""
+            self._lease_state.return_lease()
+
+        def reserve(self, amount, trans=1):
+            """Reserve counts from lease, a new lease is claimed if the
+            current one can't fit the counts."""
+            day, month = period_clock.get_periods()
+            lease_state = self._lease_state
+
+            with lease_state.lock:
+                lease = lease_state.lease
+                if lease != None and (lease.day != day or
+                        lease.month != month or lease.amount < amount or
+                        lease.trans < trans):
+                    lease_state._return_lease()
+                    lease = None
+
+                if (lease == None and
+                        time.time() >= lease_state.claim_retry_time):
+                    try:
+                        reservation = gateway_counter.reserve(self,
+                            max(amount_block, amount), max(trans_block, trans))
+                    except LimitExceeded:
+                        lease_state.claim_retry_time = (time.time() +
+                                                        idle_timeout)
+                    else:
+                        reservation.commit()
+                        lease = CounterLease(self, reservation.amount,
+                            reservation.trans, reservation.day,
+                            reservation.month)
+                        lease_state.lease = lease
+
+                if lease != None:
+                    lease.amount -= amount
+                    lease.trans -= trans
+                    lease.last_used = time.time()
+                    return LeaseReservation(self, amount, trans, lease)
+
+            # Not enough headroom for a block, reserve counts directly
+            return gateway_counter.reserve(self, amount, trans)
+
+        def _release_reservation(self, reservation):
+            """Return counts to lease, if the lease has been returned the
+            counts are returned to the backing counter."""
+            if isinstance(reservation, LeaseReservation):
+                lease_state = self._lease_state
+                with lease_state.lock:
+                    if reservation.lease is lease_state.lease:
+                        lease_state.lease.amount += reservation.amount
+                        lease_state.lease.trans += reservation.trans
+                        return
+
+            gateway_counter._release_reservation(self, reservation)
+
+    return LeasedCounter
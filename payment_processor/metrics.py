@@ -0,0 +1,216 @@
+import bisect
+import threading
+
+SUCCESS = 'success'
+"""Transaction succeeded."""
+DECLINE = 'decline'
+"""Transaction raised a :attr:`TransactionError`."""
+ERROR = 'error'
+"""Transaction raised any other exception."""
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+"""Default latency histogram bucket upper bounds in seconds."""
+
+class MetricSeries(object):
+    """Metrics of one gateway provider and transaction method. Each series
+    has its own lock so gateways only contend on the same series.
+    """
+    __slots__ = ('lock', 'bucket_counts', 'latency_sum', 'outcomes',
+                 'failovers')
+
+    def __init__(self, bucket_count):
+        self.lock = threading.Lock()
+        # One extra bucket for latencies above the largest bound
+        self.bucket_counts = [0] * (bucket_count + 1)
+        self.latency_sum = 0.0
+        self.outcomes = {SUCCESS: 0, DECLINE: 0, ERROR: 0}
+        self.failovers = 0
+
+
+class MetricsRegistry(object):
+    """Gateway metrics registry. Keeps a fixed bucket latency histogram and
+    request, outcome and failover counts for each gateway provider and
+    transaction method. Pass a registry to gateways with the `metrics`
+    argument.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*buckets*", "list", "Sorted latency bucket upper bounds in seconds.
+        Default is :attr:`DEFAULT_BUCKETS`."
+
+    Usage::
+
+        import payment_processor
+
+        metrics = payment_processor.MetricsRegistry()
+
+        gateway = payment_processor.AuthorizeNetAIM(
+                login='LOGIN', trans_key='TRANSACTION_KEY', metrics=metrics)
+
+        print metrics.prometheus()
+    """
+    buckets = None
+    """Latency bucket upper bounds in seconds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _get_series(self, provider, method):
+        """Get the series for a provider and method, creating it if
+        needed."""
+        key = (provider, method)
+        series = self._series.get(key)
+
+        if series == None:
+            with self._lock:
+                series = self._series.get(key)
+                if series == None:
+                    series = MetricSeries(len(self.buckets))
+                    self._series[key] = series
+
+        return series
+
+    def observe(self, provider, method, latency, outcome):
+        """Record a transaction.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*provider*", "string", "Gateway provider."
+            "*method*", "string", "Transaction method name."
+            "*latency*", "number", "Seconds the transaction took."
+            "*outcome*", "string", ":attr:`SUCCESS`, :attr:`DECLINE` or
+            :attr:`ERROR`."
+        """
+        series = self._get_series(provider, method)
+        index = bisect.bisect_left(self.buckets, latency)
+
+        with series.lock:
+            series.bucket_counts[index] += 1
+            series.latency_sum += latency
+            series.outcomes[outcome] += 1
+
+    def record_failover(self, provider, method):
+        """Record a :attr:`MultiGateway` moving on from a failed gateway.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*provider*", "string", "Provider of the gateway that failed."
+            "*method*", "string", "Transaction method name."
+        """
+        series = self._get_series(provider, method)
+
+        with series.lock:
+            series.failovers += 1
+
+    def reset(self):
+        """Remove all recorded metrics."""
+        with self._lock:
+            self._series = {}
+
+    def snapshot(self):
+        """Get a copy of the recorded metrics.
+
+        Returns:
+
+        Dictonary of providers containing a dictonary of methods. Each
+        method contains `requests`, `success`, `decline`, `error`,
+        `failovers`, `latency_sum` and `buckets`, a list of cumulative
+        ``(upper_bound, count)`` tuples ending with ``float('inf')``.
+        """
+        snapshot = {}
+
+        for (provider, method), series in self._series.items():
+            with series.lock:
+                bucket_counts = list(series.bucket_counts)
+                latency_sum = series.latency_sum
+                outcomes = dict(series.outcomes)
+                failovers = series.failovers
+
+            buckets = []
+            total = 0
+            for upper_bound, count in zip(
+                    self.buckets + (float('inf'),), bucket_counts):
+                total += count
+                buckets.append((upper_bound, total))
+
+            snapshot.setdefault(provider, {})[method] = dict(
+                requests=total,
+                success=outcomes[SUCCESS],
+                decline=outcomes[DECLINE],
+                error=outcomes[ERROR],
+                failovers=failovers,
+                latency_sum=latency_sum,
+                buckets=buckets,
+            )
+
+        return snapshot
+
+    def prometheus(self, prefix='payment_processor'):
+        """Get the recorded metrics in the Prometheus text format.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*prefix*", "string", "Metric name prefix."
+
+        Returns:
+
+        String of metrics.
+        """
+        snapshot = self.snapshot()
+        series = sorted((provider, method, data)
+                        for provider, methods in snapshot.items()
+                        for method, data in methods.items())
+
+        duration = prefix + '_request_duration_seconds'
+        lines = [
+            '# HELP %s Gateway transaction latency.' % duration,
+            '# TYPE %s histogram' % duration,
+        ]
+        for provider, method, data in series:
+            labels = 'provider="%s",method="%s"' % (provider, method)
+            for upper_bound, count in data['buckets']:
+                if upper_bound == float('inf'):
+                    upper_bound = '+Inf'
+                lines.append('%s_bucket{%s,le="%s"} %d' % (
+                    duration, labels, upper_bound, count))
+            lines.append('%s_sum{%s} %r' % (duration, labels,
+                                            data['latency_sum']))
+            lines.append('%s_count{%s} %d' % (duration, labels,
+                                              data['requests']))
+
+        requests = prefix + '_requests_total'
+        lines.append('# HELP %s Gateway transactions by outcome.' % requests)
+        lines.append('# TYPE %s counter' % requests)
+        for provider, method, data in series:
+            for outcome in (SUCCESS, DECLINE, ERROR):
+                lines.append(
+                    '%s{provider="%s",method="%s",outcome="%s"} %d' % (
+                    requests, provider, method, outcome, data[outcome]))
+
+        failovers = prefix + '_failovers_total'
+        lines.append('# HELP %s Gateway failures followed by failover.' %
+                     failovers)
+        lines.append('# TYPE %s counter' % failovers)
+        for provider, method, data in series:
+            lines.append('%s{provider="%s",method="%s"} %d' % (
+                failovers, provider, method, data['failovers']))
+
+        return '\n'.join(lines) + '\n'
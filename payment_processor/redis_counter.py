@@ -0,0 +1,183 @@
+from payment_processor.exceptions import *
+from payment_processor.counter import (GatewayCounter, CounterReservation,
+    period_clock)
+import datetime
+import time
+
+# Import redis if not aviable the redis module will be exlcuded
+try:
+    import redis
+except ImportError:
+    import logging
+    logging.warning('Redis not aviable, removing RedisCounter.')
+    raise RedisNotAviable('Redis not aviable.')
+
+KEY_PREFIX = 'payment_processor'
+"""Prefix of redis counter keys."""
+
+CHANGE_SCRIPT = """
+local day_amount = tonumber(redis.call('HGET', KEYS[1], 'amount_cents') or '0')
+local day_trans = tonumber(redis.call('HGET', KEYS[1], 'trans') or '0')
+local month_amount = tonumber(redis.call('HGET', KEYS[2], 'amount_cents') or '0')
+local month_trans = tonumber(redis.call('HGET', KEYS[2], 'trans') or '0')
+
+if ARGV[5] ~= '' and day_amount + tonumber(ARGV[1]) >= tonumber(ARGV[5]) then
+    return 1
+end
+if ARGV[6] ~= '' and month_amount + tonumber(ARGV[2]) >= tonumber(ARGV[6]) then
+    return 2
+end
+if ARGV[7] ~= '' and day_trans + tonumber(ARGV[3]) >= tonumber(ARGV[7]) then
+    return 3
+end
+if ARGV[8] ~= '' and month_trans + tonumber(ARGV[4]) >= tonumber(ARGV[8]) then
+    return 4
+end
+
+redis.call('HINCRBY', KEYS[1], 'amount_cents', ARGV[1])
+redis.call('HINCRBY', KEYS[2], 'amount_cents', ARGV[2])
+redis.call('HINCRBY', KEYS[1], 'trans', ARGV[3])
+redis.call('HINCRBY', KEYS[2], 'trans', ARGV[4])
+redis.call('EXPIREAT', KEYS[1], ARGV[9])
+redis.call('EXPIREAT', KEYS[2], ARGV[10])
+return 0
+"""
+"""Lua script that checks limits and changes day and month counts. Amounts
+and amount limits are in integer cents, empty limits are not checked."""
+
+LIMIT_ERRORS = {
+    1: 'Gateway day amount limit reached.',
+    2: 'Gateway month amount limit reached.',
+    3: 'Gateway day transaction limit reached.',
+    4: 'Gateway month transaction limit reached.',
+}
+"""Limit exceeded messages of change script return codes."""
+
+_client = None
+_change_script = None
+
+
+def _to_cents(amount):
+    """Convert amount to integer cents stored in counter hashes."""
+    return int(round(amount * 100))
+
+
+def _get_expire_times(day, month):
+    """Get unix times at the end of day and month periods."""
+    day_end = datetime.date.fromordinal(day + 1)
+    year, month = divmod(month + 1, 12)
+    month_end = datetime.date(year, month + 1, 1)
+    return (int(time.mktime(day_end.timetuple())),
+            int(time.mktime(month_end.timetuple())))
+
+
+class RedisGatewayCounter(GatewayCounter):
+    """Counter gateway that uses redis to store counters. Each day and month
+    is stored in a hash that expires at the end of the period, amounts are
+    stored in integer cents. Limits are
+    checked and counts changed with a server side script in one round trip.
+    Requires :func:`connect_redis`."""
+    _window_limits_supported = False
+
+    def _get_keys(self, day, month):
+        """Get redis keys of day and month periods."""
+        return ('%s:%s:day:%d' % (KEY_PREFIX, self.provider, day),
+                '%s:%s:month:%d' % (KEY_PREFIX, self.provider, month))
+
+    def _change_counts(self, changes, day, month, check_limits=False):
+        """Change counts of day and month periods with change script.
+
+        Returns:
+
+        Change script return code, `0` if the counts were changed.
+        """
+        if _client == None:
+            raise CounterError('Redis counter is not connected.')
+
+        day_amount_change, month_amount_change, day_trans_change, \
+            month_trans_change = changes
+        changes = [_to_cents(day_amount_change),
+                   _to_cents(month_amount_change),
+                   day_trans_change, month_trans_change]
+
+        limits = ['', '', '', '']
+        if check_limits:
+            for index, limit in enumerate((self.day_amount_limit,
+                    self.month_amount_limit)):
+                if limit != None:
+                    limits[index] = _to_cents(limit)
+            for index, limit in enumerate((self.day_trans_limit,
+                    self.month_trans_limit)):
+                if limit != None:
+                    limits[index + 2] = limit
+
+        try:
+            return _change_script(
+                keys=self._get_keys(day, month),
+                args=changes + limits + list(_get_expire_times(day, month)))
+        except redis.RedisError, exception:
+            raise CounterError(exception)
+
+    def reserve(self, amount, trans=1):
+        """Check limits and reserve counts in redis in one round trip."""
+        day, month = period_clock.get_periods()
+
+        result = self._change_counts((amount, amount, trans, trans),
+                                     day, month, check_limits=True)
+        if result != 0:
+            raise LimitExceeded(LIMIT_ERRORS[result])
+
+        return CounterReservation(self, amount, trans, day, month)
+
+    def _release_reservation(self, reservation):
+        """Return reserved counts to the redis keys of the day and month they
+        were reserved in."""
+        self._change_counts((
+            reservation.amount * -1, reservation.amount * -1,
+            reservation.trans * -1, reservation.trans * -1,
+        ), reservation.day, reservation.month)
+
+    def get_counts(self):
+        """Get counts from redis."""
+        if _client == None:
+            raise CounterError('Redis counter is not connected.')
+
+        day_key, month_key = self._get_keys(*period_clock.get_periods())
+
+        try:
+            pipeline = _client.pipeline(transaction=False)
+            pipeline.hmget(day_key, 'amount_cents', 'trans')
+            pipeline.hmget(month_key, 'amount_cents', 'trans')
+            day_counts, month_counts = pipeline.execute()
+        except redis.RedisError, exception:
+            raise CounterError(exception)
+
+        return (int(day_counts[0] or 0) / 100.0,
+                int(month_counts[0] or 0) / 100.0,
+                int(day_counts[1] or 0), int(month_counts[1] or 0))
+
+    def set_counts(self, day_amount_change, month_amount_change,
+                   day_trans_change, month_trans_change):
+        """Set counts in redis."""
+        day, month = period_clock.get_periods()
+        self._change_counts((day_amount_change, month_amount_change,
+                             day_trans_change, month_trans_change),
+                            day, month)
+
+
+def connect_redis(redis_url):
+    """Connection to redis server.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*redis_url*", "string", "Redis url such as
+        ``redis://localhost:6379/0``."
+    """
+    global _client, _change_script
+
+    _client = redis.StrictRedis.from_url(redis_url)
+    _change_script = _client.register_script(CHANGE_SCRIPT)
@@ -0,0 +1,289 @@
+from payment_processor.exceptions import *
+from payment_processor.counter import (GatewayCounter, CounterReservation,
+    period_clock)
+import contextlib
+import mmap
+import os
+import struct
+import threading
+
+# Import fcntl if not aviable the shared memory module will be exlcuded
+try:
+    import fcntl
+except ImportError:
+    import logging
+    logging.warning('fcntl not aviable, removing SharedMemoryCounter.')
+    raise SharedMemoryNotAviable('fcntl not aviable.')
+
+MAGIC = 'PPCOUNT2'
+"""Shared memory file identifier. Files of version 1 stored amounts as
+doubles and are not read."""
+
+HEADER = struct.Struct('=8sI')
+"""File header, magic and number of slots."""
+
+COUNTS = struct.Struct('=iiqqqq')
+"""Slot counts, day period, month period, day amount count, month amount
+count, day trans count and month trans count. Amounts are in cents."""
+
+NAME_SIZE = 64
+"""Maximum length of provider name."""
+
+SLOT_SIZE = 128
+"""Size of file header and each provider slot."""
+
+
+class SharedMemorySegment(object):
+    """Memory mapped counter file. The file contains a header followed by a
+    fixed number of provider slots. Each slot is locked across processes
+    with a file record lock and across threads with a thread lock.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*path*", "string", "Path of shared memory file."
+        "*slots*", "number", "Number of provider slots when the file is
+        created. Default is `64`."
+    """
+    path = None
+    """Path of shared memory file."""
+    slots = None
+    """Number of provider slots."""
+
+    def __init__(self, path, slots=64):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        self._slot_indexes = {}
+        self._alloc_lock = threading.Lock()
+
+        # Create or read header while holding the header lock
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT_SIZE, 0)
+        try:
+            size = os.fstat(self._fd).st_size
+            if size == 0:
+                size = SLOT_SIZE * (slots + 1)
+                os.ftruncate(self._fd, size)
+                self._mmap = mmap.mmap(self._fd, size)
+                HEADER.pack_into(self._mmap, 0, MAGIC, slots)
+            else:
+                self._mmap = mmap.mmap(self._fd, size)
+                magic, slots = HEADER.unpack_from(self._mmap, 0)
+                if magic != MAGIC:
+                    raise CounterError(
+                        '%r is not a shared memory counter file.' % path)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT_SIZE, 0)
+
+        self.slots = slots
+        self._slot_locks = [threading.Lock() for _ in xrange(slots)]
+
+    def close(self):
+        """Unmap and close shared memory file."""
+        self._mmap.close()
+        os.close(self._fd)
+
+    @contextlib.contextmanager
+    def lock_slot(self, index):
+        """Lock a slot across threads and processes.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*index*", "number", "Slot index."
+
+        Returns:
+
+        Context manager that yields the offset of the slot counts.
+        """
+        offset = SLOT_SIZE * (index + 1)
+
+        with self._slot_locks[index]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT_SIZE, offset)
+            try:
+                yield offset + NAME_SIZE
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT_SIZE, offset)
+
+    def get_slot(self, provider):
+        """Get slot index of provider, a free slot is claimed if the provider
+        doesn't have one.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*provider*", "string", "Gateway provider."
+
+        Returns:
+
+        Slot index.
+        """
+        index = self._slot_indexes.get(provider)
+        if index != None:
+            return index
+
+        if len(provider) > NAME_SIZE:
+            raise CounterError('Provider name %r is too long.' % provider)
+
+        with self._alloc_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT_SIZE, 0)
+            try:
+                free_index = None
+                for index in xrange(self.slots):
+                    offset = SLOT_SIZE * (index + 1)
+                    name = self._mmap[offset:offset + NAME_SIZE].rstrip('\0')
+                    if name == provider:
+                        break
+                    if name == '' and free_index == None:
+                        free_index = index
+                else:
+                    if free_index == None:
+                        raise CounterError('No free shared memory slots.')
+
+                    # Claim free slot
+                    index = free_index
+                    offset = SLOT_SIZE * (index + 1)
+                    self._mmap[offset:offset + NAME_SIZE] = provider.ljust(
+                        NAME_SIZE, '\0')
+                    COUNTS.pack_into(self._mmap, offset + NAME_SIZE,
+                                     0, 0, 0, 0, 0, 0)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT_SIZE, 0)
+
+        self._slot_indexes[provider] = index
+        return index
+
+    def read_counts(self, offset, day, month):
+        """Read slot counts, counts from a previous period are returned as
+        zero. Must be called with slot locked.
+
+        Returns:
+
+        A tuple containing `day_amount_count`, `month_amount_count`,
+        `day_trans_count`, `month_trans_count`. Amounts are in cents.
+        """
+        (slot_day, slot_month, day_amount_count, month_amount_count,
+            day_trans_count, month_trans_count) = COUNTS.unpack_from(
+                self._mmap, offset)
+
+        if slot_day != day:
+            day_amount_count = 0
+            day_trans_count = 0
+        if slot_month != month:
+            month_amount_count = 0
+            month_trans_count = 0
+
+        return (day_amount_count, month_amount_count,
+                day_trans_count, month_trans_count)
+
+    def write_counts(self, offset, day, month, counts):
+        """Write slot counts, amounts in cents. Must be called with slot
+        locked."""
+        COUNTS.pack_into(self._mmap, offset, day, month, *counts)
+
+
+_segment = None
+
+
+def _to_cents(amount):
+    """Convert amount to integer cents stored in provider slots."""
+    return int(round(amount * 100))
+
+
+def _from_cents(counts):
+    """Convert slot counts with amounts in cents to counts with amounts."""
+    return (counts[0] / 100.0, counts[1] / 100.0, counts[2], counts[3])
+
+
+class SharedMemoryGatewayCounter(GatewayCounter):
+    """Counter gateway that stores counters in a shared memory file. All
+    processes on a host using the same file share the counters, each check
+    and change is done with the provider slot locked. Amounts are stored in
+    integer cents. Requires :func:`connect_shared_memory`."""
+    _window_limits_supported = False
+
+    def _get_slot(self):
+        """Get shared memory segment and slot of gateway provider."""
+        if _segment == None:
+            raise CounterError('Shared memory counter is not connected.')
+        return _segment, _segment.get_slot(self.provider)
+
+    def _change_counts(self, changes, day, month, check_limits=False):
+        """Change counts of gateway provider slot."""
+        segment, index = self._get_slot()
+        changes = (_to_cents(changes[0]), _to_cents(changes[1]),
+                   changes[2], changes[3])
+
+        with segment.lock_slot(index) as offset:
+            counts = [count + change for count, change in zip(
+                      segment.read_counts(offset, day, month), changes)]
+            if check_limits:
+                self._check_limits(*_from_cents(counts))
+            segment.write_counts(offset, day, month, counts)
+
+    def reserve(self, amount, trans=1):
+        """Check limits and reserve counts in shared memory."""
+        day, month = period_clock.get_periods()
+        self._change_counts((amount, amount, trans, trans), day, month,
+                            check_limits=True)
+        return CounterReservation(self, amount, trans, day, month)
+
+    def _release_reservation(self, reservation):
+        """Return reserved counts to shared memory. Counts are only returned
+        to the day and month they were reserved in."""
+        day, month = period_clock.get_periods()
+        same_day = reservation.day == day
+        same_month = reservation.month == month
+
+        self._change_counts((
+            reservation.amount * -1 if same_day else 0,
+            reservation.amount * -1 if same_month else 0,
+            reservation.trans * -1 if same_day else 0,
+            reservation.trans * -1 if same_month else 0,
+        ), day, month)
+
+    def get_counts(self):
+        """Get counts from shared memory."""
+        day, month = period_clock.get_periods()
+        segment, index = self._get_slot()
+
+        with segment.lock_slot(index) as offset:
+            return _from_cents(segment.read_counts(offset, day, month))
+
+    def set_counts(self, day_amount_change, month_amount_change,
+                   day_trans_change, month_trans_change):
+        """Set counts in shared memory."""
+        day, month = period_clock.get_periods()
+        self._change_counts((day_amount_change, month_amount_change,
+                             day_trans_change, month_trans_change),
+                            day, month)
+
+
+def connect_shared_memory(path, slots=64):
+    """Connect to shared memory counter file. If the file doesn't exists it
+    will be created. Use a file on a memory backed file system such as
+    ``/dev/shm``. Can be called before or after worker processes are forked.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*path*", "string", "Path of shared memory file."
+        "*slots*", "number", "Number of provider slots when the file is
+        created. Default is `64`."
+    """
+    global _segment
+
+    if _segment != None:
+        _segment.close()
+    _segment = SharedMemorySegment(path, slots)
@@ -1,93 +1,906 @@
 from payment_processor.exceptions import *
-from payment_processor.counter import GatewayCounter
-from payment_processor.database import CounterTable, Session
+from payment_processor.counter import (GatewayCounter, CounterReservation,
+    period_clock)
+from payment_processor.database import (CounterTable, CounterWindowTable,
+    get_engine, session_scope)
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import *
-import datetime
+import atexit
+import itertools
+import logging
+import math
+import os
+import threading
+import time
 
-class SQLGatewayCounter(GatewayCounter):
-    """Counter gateway that uses sql to store counters."""
+def _to_cents(amount):
+    """Convert amount to integer cents stored in counter tables."""
+    return int(round(amount * 100))
 
-    def __init__(self, *args, **kwargs):
-        GatewayCounter.__init__(self, *args, **kwargs)
 
-        # If gateway column doesnt exists create it
-        session = Session()
-        gateway_column = session.query(CounterTable).filter(
-                        CounterTable.provider == self.provider).first()
-        if gateway_column == None:
-            self._create_column()
-
-    def _create_column(self):
-        """Create required column for gateway counters. This is called if
-        gateway column doesn't exists in database."""
-        current_date = datetime.date.today()
-        session = Session()
-
-        # Create authorize net column
-        authorize_net = CounterTable(self.provider)
-        authorize_net.day_amount_count = 0.0
-        authorize_net.month_amount_count = 0.0
-        authorize_net.day_trans_count = 0
-        authorize_net.month_trans_count = 0
-        authorize_net.day_count_timestamp = current_date.strftime('%Y%m%d')
-        authorize_net.month_count_timestamp = current_date.strftime('%Y%m')
-        session.add(authorize_net)
-
-        session.commit()
+_thread_shards = threading.local()
+_thread_numbers = itertools.count()
+_created_rows = set()
+_created_rows_lock = threading.Lock()
 
-    def get_counts(self):
-        """Get counts from sql database."""
-        session = Session()
-        current_date = datetime.date.today()
-        day_timestamp = current_date.strftime('%Y%m%d')
-        month_timestamp = current_date.strftime('%Y%m')
 
-        # Get gateway conuter data
-        try:
-            gateway_data = session.query(CounterTable).filter(
-                            CounterTable.provider == self.provider).first()
-        except SQLAlchemyError, exception:
-            raise CounterError(exception)
-
-        # If timestamp has changed reset count
-        if gateway_data.day_count_timestamp != day_timestamp:
-            gateway_data.day_amount_count = 0.0
-            gateway_data.day_trans_count = 0
-            gateway_data.day_count_timestamp = day_timestamp
+def _insert_missing(session, table, rows):
+    """Insert rows with one statement, rows that conflict with an existing
+    row are skipped. Dialects without an insert that ignores conflicts
+    insert each row in a savepoint.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*session*", "object", "SQL session, not commited."
+        "*table*", "object", "SQL table."
+        "*rows*", "list", "Column values of each row."
+    """
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        statement = postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect == 'mysql':
+        statement = table.insert().prefix_with('IGNORE')
+    elif dialect == 'sqlite':
+        statement = table.insert().prefix_with('OR IGNORE')
+    else:
+        for row in rows:
             try:
-                session.commit()
-            except SQLAlchemyError, exception:
-                raise CounterError(exception)
-
-        if gateway_data.month_count_timestamp != month_timestamp:
-            gateway_data.month_amount_count = 0.0
-            gateway_data.month_trans_count = 0
-            gateway_data.month_count_timestamp = month_timestamp
+                with session.begin_nested():
+                    session.execute(table.insert().values(**row))
+            except IntegrityError:
+                # Row created by another process
+                pass
+        return
+
+    session.execute(statement, rows)
+
+
+def _get_thread_shard(shards):
+    """Get shard of current thread. Threads of a process are given shards in
+    turn starting at an offset from the process id.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*shards*", "number", "Number of shards of gateway provider."
+    """
+    if shards == 1:
+        return 0
+
+    number = getattr(_thread_shards, 'number', None)
+    if number == None:
+        number = _thread_shards.number = next(_thread_numbers)
+
+    return (os.getpid() + number) % shards
+
+
+def _create_provider_rows(provider, shards, window_limits=()):
+    """Create missing counter rows of gateway provider, one for each shard,
+    and the bucket rows of each window limit. Rows are created once for each
+    process on first use of a counter, not when the gateway is created.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*provider*", "str", "Gateway provider."
+        "*shards*", "number", "Number of shards of gateway provider."
+        "*window_limits*", "tuple", "Window limits of gateway provider."
+    """
+    rows_key = (get_engine(), provider, shards, tuple(
+        (window_limit.seconds, window_limit.buckets)
+        for window_limit in window_limits))
+    if rows_key in _created_rows:
+        return
+
+    with _created_rows_lock:
+        if rows_key in _created_rows:
+            return
+
+        day, month = period_clock.get_periods()
+
+        with session_scope() as session:
+            _insert_missing(session, CounterTable.__table__, [{
+                'provider': provider,
+                'shard': shard,
+                'day_amount_count': 0,
+                'month_amount_count': 0,
+                'day_trans_count': 0,
+                'month_trans_count': 0,
+                'day': day,
+                'month': month,
+            } for shard in xrange(shards)])
+
+            for window_limit in window_limits:
+                _insert_missing(session, CounterWindowTable.__table__, [{
+                    'provider': provider,
+                    'window_seconds': window_limit.seconds,
+                    'bucket': bucket,
+                    'amount_count': 0,
+                    'trans_count': 0,
+                    'epoch': 0,
+                } for bucket in xrange(window_limit.buckets)])
+
+        _created_rows.add(rows_key)
+
+
+def _update_provider_counts(session, provider, day_amount_change,
+                            month_amount_change, day_trans_change,
+                            month_trans_change, day, month, shard=0,
+                            shares=None):
+    """Change counts of a shard with one update statement. Counts from a
+    previous day or month are reset as part of the update.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*session*", "object", "SQL session, not commited."
+        "*provider*", "str", "Gateway provider."
+        "*day_amount_change*", "number", "Change in day amount count."
+        "*month_amount_change*", "number", "Change in month amount count."
+        "*day_trans_change*", "number", "Change in day trans count."
+        "*month_trans_change*", "number", "Change in month trans count."
+        "*day*", "number", "Current day period."
+        "*month*", "number", "Current month period."
+        "*shard*", "number", "Shard number. Default is `0`."
+        "*shares*", "list", "Only update if no share of a limit would be
+        exceeded. Default is ``None``."
+
+    Returns:
+
+    ``True`` if the counts were updated.
+    """
+    table = CounterTable.__table__
+
+    # Counts after rollover and change
+    same_day = table.c.day == day
+    same_month = table.c.month == month
+    day_amount_count = case([(same_day, table.c.day_amount_count)],
+                            else_=0) + _to_cents(day_amount_change)
+    month_amount_count = case([(same_month, table.c.month_amount_count)],
+                              else_=0) + _to_cents(month_amount_change)
+    day_trans_count = case([(same_day, table.c.day_trans_count)],
+                           else_=0) + day_trans_change
+    month_trans_count = case([(same_month, table.c.month_trans_count)],
+                             else_=0) + month_trans_change
+
+    conditions = [table.c.provider == provider, table.c.shard == shard]
+    if shares != None:
+        for count, share in zip((day_amount_count, month_amount_count,
+                day_trans_count, month_trans_count), shares):
+            if share != None:
+                conditions.append(count <= share)
+
+    # Values are rendered in table column order so the periods are set
+    # last, MySQL evaluates assignments left to right
+    statement = table.update().where(and_(*conditions)).values(
+        day_amount_count=day_amount_count,
+        month_amount_count=month_amount_count,
+        day_trans_count=day_trans_count,
+        month_trans_count=month_trans_count,
+        day=day,
+        month=month,
+    )
+
+    return session.execute(statement).rowcount > 0
+
+
+def _add_provider_period_counts(session, provider, changes, day, month,
+                                shard=0):
+    """Add count changes of a shard only to the day and month given, counts
+    of a later period are left unchanged.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*session*", "object", "SQL session, not commited."
+        "*provider*", "str", "Gateway provider."
+        "*changes*", "tuple", "Changes in day amount, month amount, day
+        trans and month trans counts."
+        "*day*", "number", "Day period of changes."
+        "*month*", "number", "Month period of changes."
+        "*shard*", "number", "Shard number. Default is `0`."
+    """
+    table = CounterTable.__table__
+    same_day = table.c.day == day
+    same_month = table.c.month == month
+    (day_amount_change, month_amount_change, day_trans_change,
+        month_trans_change) = changes
+    day_amount_change = _to_cents(day_amount_change)
+    month_amount_change = _to_cents(month_amount_change)
+
+    session.execute(table.update().where(and_(
+        table.c.provider == provider,
+        table.c.shard == shard)).values(
+        day_amount_count=case(
+            [(same_day, table.c.day_amount_count + day_amount_change)],
+            else_=table.c.day_amount_count),
+        month_amount_count=case(
+            [(same_month,
+              table.c.month_amount_count + month_amount_change)],
+            else_=table.c.month_amount_count),
+        day_trans_count=case(
+            [(same_day, table.c.day_trans_count + day_trans_change)],
+            else_=table.c.day_trans_count),
+        month_trans_count=case(
+            [(same_month,
+              table.c.month_trans_count + month_trans_change)],
+            else_=table.c.month_trans_count),
+    ))
+
+
+def _select_provider_counts(session, provider, day, month):
+    """Get counts of gateway provider from sql database, counts of all shards
+    are added together. Counts from a previous day or month are returned as
+    zero, they are reset by the next update.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*session*", "object", "SQL session."
+        "*provider*", "str", "Gateway provider."
+        "*day*", "number", "Current day period."
+        "*month*", "number", "Current month period."
+    """
+    # Get gateway conuter data
+    gateway_rows = session.query(CounterTable).filter(
+                    CounterTable.provider == provider).all()
+
+    day_amount_count = 0
+    day_trans_count = 0
+    month_amount_count = 0
+    month_trans_count = 0
+    for gateway_data in gateway_rows:
+        if gateway_data.day == day:
+            day_amount_count += gateway_data.day_amount_count
+            day_trans_count += gateway_data.day_trans_count
+
+        if gateway_data.month == month:
+            month_amount_count += gateway_data.month_amount_count
+            month_trans_count += gateway_data.month_trans_count
+
+    return (day_amount_count / 100.0, month_amount_count / 100.0,
+            day_trans_count, month_trans_count)
+
+
+class ShardReservation(CounterReservation):
+    """Counts reserved on sql counter shard rows. A reservation that didn't
+    fit one shard is split across shards."""
+    parts = None
+    """List of shard, amount and trans reserved on each shard."""
+
+    def __init__(self, counter, amount, trans, day, month, reserved_time,
+                 parts):
+        CounterReservation.__init__(self, counter, amount, trans, day, month,
+                                    reserved_time)
+        self.parts = parts
+
+
+class CounterWriteBuffer(object):
+    """Write behind buffer of sql counter changes of one gateway provider.
+    Changes from all threads are added together in memory and written with
+    one update by a flusher thread. Limits are checked against the counts
+    read at the last flush plus the buffered changes, a reservation
+    released before the flush never reaches the database. After the buffer
+    is closed on shutdown changes are written when they are made.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*provider*", "str", "Gateway provider of counts."
+        "*shards*", "number", "Number of shards of gateway provider."
+        "*flush_interval*", "number", "Seconds to wait before writing
+        changes."
+        "*flush_size*", "number", "Number of changes that starts a write
+        before the interval."
+        "*max_staleness*", "number", "Seconds after the last read of the
+        database counts before they are read again before a check."
+    """
+    provider = None
+    """Gateway provider of counts."""
+    shards = None
+    """Number of shards of gateway provider."""
+    flush_interval = None
+    """Seconds to wait before writing changes."""
+    flush_size = None
+    """Number of changes that starts a write before the interval."""
+    max_staleness = None
+    """Seconds before database counts are read again before a check."""
+
+    def __init__(self, provider, shards, flush_interval, flush_size,
+                 max_staleness):
+        self.provider = provider
+        self.shards = shards
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_staleness = max_staleness
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._flushing = {}
+        self._operations = 0
+        self._counts = (0, 0, 0, 0)
+        self._periods = None
+        self._read_time = 0
+        self._pending_event = threading.Event()
+        self._full_event = threading.Event()
+        self._closed = False
+
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        """Flusher thread."""
+        while not self._closed:
+            self._pending_event.wait()
+            self._pending_event.clear()
+            self._full_event.wait(self.flush_interval)
+            self._full_event.clear()
+
+            if self._closed:
+                return
+
             try:
-                session.commit()
-            except SQLAlchemyError, exception:
-                raise CounterError(exception)
+                self.flush()
+            except Exception:
+                logging.exception('Failed to write sql counter changes.')
 
-        counts = (gateway_data.day_amount_count, gateway_data.month_amount_count,
-                gateway_data.day_trans_count, gateway_data.month_trans_count)
+    def _get_counts(self, day, month):
+        """Get database counts plus buffered changes. Must be called with
+        lock held."""
+        counts = [0, 0, 0, 0]
+        if self._periods != None:
+            if self._periods[0] == day:
+                counts[0] = self._counts[0]
+                counts[2] = self._counts[2]
+            if self._periods[1] == month:
+                counts[1] = self._counts[1]
+                counts[3] = self._counts[3]
 
-        session.close()
+        for changes in (self._flushing, self._pending):
+            for (change_day, change_month), change in changes.items():
+                if change_day == day:
+                    counts[0] += change[0]
+                    counts[2] += change[2]
+                if change_month == month:
+                    counts[1] += change[1]
+                    counts[3] += change[3]
 
         return counts
 
+    def get_counts(self, day, month):
+        """Get database counts plus buffered changes.
+
+        Returns:
+
+        A tuple containing `day_amount_count`, `month_amount_count`,
+        `day_trans_count`, `month_trans_count`
+        """
+        if time.time() - self._read_time >= self.max_staleness:
+            self.flush()
+
+        with self._lock:
+            return tuple(self._get_counts(day, month))
+
+    def change(self, changes, day, month, check=None):
+        """Buffer count changes.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*changes*", "tuple", "Changes in day amount, month amount, day
+            trans and month trans counts."
+            "*day*", "number", "Day period of changes."
+            "*month*", "number", "Month period of changes."
+            "*check*", "function", "Called with the new counts before the
+            changes are buffered."
+        """
+        if (check != None and
+                time.time() - self._read_time >= self.max_staleness):
+            self.flush()
+
+        with self._lock:
+            if check != None:
+                check(*[count + change for count, change in zip(
+                        self._get_counts(day, month), changes)])
+
+            pending = self._pending.get((day, month))
+            if pending == None:
+                self._pending[(day, month)] = list(changes)
+            else:
+                for index, change in enumerate(changes):
+                    pending[index] += change
+
+            self._operations += 1
+            full = self._operations >= self.flush_size
+
+        # Flusher thread has stopped on shutdown, changes made by later
+        # exit handlers are written now
+        if self._closed:
+            self.flush()
+            return
+
+        self._pending_event.set()
+        if full:
+            self._full_event.set()
+
+    def flush(self):
+        """Write buffered changes and read database counts."""
+        with self._flush_lock:
+            with self._lock:
+                self._flushing = flushing = self._pending
+                self._pending = {}
+                self._operations = 0
+
+                # Reservations released before the flush cancel out
+                if (not any(any(changes) for changes in flushing.values())
+                        and time.time() - self._read_time <
+                        self.max_staleness):
+                    self._flushing = {}
+                    return
+
+            day, month = period_clock.get_periods()
+            shard = _get_thread_shard(self.shards)
+            try:
+                _create_provider_rows(self.provider, self.shards)
+
+                with session_scope() as session:
+                    for (change_day, change_month), changes in \
+                            flushing.items():
+                        if not any(changes):
+                            continue
+
+                        if change_day == day and change_month == month:
+                            _update_provider_counts(session, self.provider,
+                                *changes, day=day, month=month, shard=shard)
+                        else:
+                            _add_provider_period_counts(session,
+                                self.provider, changes, change_day,
+                                change_month, shard=shard)
+
+                    counts = _select_provider_counts(session, self.provider,
+                                                     day, month)
+            except Exception:
+                # Keep changes for the next flush
+                with self._lock:
+                    for key, changes in flushing.items():
+                        pending = self._pending.setdefault(key, [0, 0, 0, 0])
+                        for index, change in enumerate(changes):
+                            pending[index] += change
+                    self._flushing = {}
+                raise
+
+            with self._lock:
+                self._counts = counts
+                self._periods = (day, month)
+                self._read_time = time.time()
+                self._flushing = {}
+
+
+_write_buffers = {}
+_write_buffers_lock = threading.Lock()
+
+
+@atexit.register
+def _flush_write_buffers():
+    """Write buffered changes of all sql counters on shutdown."""
+    for write_buffer in _write_buffers.values():
+        write_buffer._closed = True
+        write_buffer._pending_event.set()
+        write_buffer._full_event.set()
+        try:
+            write_buffer.flush()
+        except Exception:
+            logging.exception('Failed to write sql counter changes.')
+
+
+class SQLGatewayCounter(GatewayCounter):
+    """Counter gateway that uses sql to store counters. Counts are checked
+    and changed with a single conditional update so concurrent workers
+    can't exceed limits or lose updates. Window limits add one update and
+    one select for each window to the same database transaction.
+
+    With write behind changes are buffered by a :attr:`CounterWriteBuffer`
+    shared by all counters of the gateway provider in the process. Limits
+    are exact within the process, changes from other processes are seen
+    after at most `max_staleness` seconds. All counters of the gateway
+    provider in the process must use the same shard and flush settings.
+    Window limits are not supported with write behind.
+
+    With more than one shard the counts of the gateway provider are split
+    across shard rows so workers don't wait on the lock of a single row.
+    Each thread writes to its own shard and each shard may hold an equal
+    part of every limit. A transaction that doesn't fit its shard is split
+    across the other shards, limits are exact. All processes must use the
+    same number of shards. Window counts are not sharded.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*shards*", "number", "Number of rows counts are split across.
+        Default is `1`."
+        "*write_behind*", "bool", "Buffer changes and write them in groups.
+        Default is ``False``."
+        "*flush_interval*", "number", "Seconds to buffer changes before
+        writing them. Default is `0.01`."
+        "*flush_size*", "number", "Number of buffered changes that starts a
+        write before the interval. Default is `100`."
+        "*max_staleness*", "number", "Seconds before database counts are read
+        again before a check. Default is `1`."
+    """
+    shards = 1
+    """Number of rows counts are split across."""
+    _write_buffer = None
+
+    def __init__(self, *args, **kwargs):
+        self.shards = kwargs.pop('shards', 1)
+        write_behind = kwargs.pop('write_behind', False)
+        flush_interval = kwargs.pop('flush_interval', 0.01)
+        flush_size = kwargs.pop('flush_size', 100)
+        max_staleness = kwargs.pop('max_staleness', 1)
+        GatewayCounter.__init__(self, *args, **kwargs)
+
+        if self.shards < 1:
+            raise ValueError('Counter shards must be at least one.')
+
+        if write_behind:
+            if self.window_limits:
+                raise TypeError('Window limits are not supported with ' +
+                                'write behind.')
+
+            with _write_buffers_lock:
+                write_buffer = _write_buffers.get(self.provider)
+                if write_buffer == None:
+                    write_buffer = CounterWriteBuffer(self.provider,
+                        self.shards, flush_interval, flush_size,
+                        max_staleness)
+                    _write_buffers[self.provider] = write_buffer
+                elif (write_buffer.shards, write_buffer.flush_interval,
+                        write_buffer.flush_size,
+                        write_buffer.max_staleness) != (self.shards,
+                        flush_interval, flush_size, max_staleness):
+                    raise ValueError('Write behind settings must match ' +
+                        'other counters of gateway provider.')
+            self._write_buffer = write_buffer
+
+    def _create_rows(self):
+        """Create missing gateway rows once for each process. This is called
+        on first use of the counter, not when the gateway is created."""
+        _create_provider_rows(self.provider, self.shards, self.window_limits)
+
+    def _session_scope(self):
+        """Provide a transaction on the session of the current thread, gateway
+        rows are created first if needed."""
+        self._create_rows()
+        return session_scope()
+
+    def _get_shard(self):
+        """Get shard of current thread."""
+        return _get_thread_shard(self.shards)
+
+    def _get_shares(self, shard):
+        """Get the part of each limit a shard may hold. Shares of all shards
+        add up to the largest count allowed by the limit.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*shard*", "number", "Shard number."
+
+        Returns:
+
+        A list containing `day_amount_share`, `month_amount_share`,
+        `day_trans_share`, `month_trans_share`. Amounts are in cents, shares
+        of limits that aren't set are ``None``.
+        """
+        shares = []
+        for limit, amount in ((self.day_amount_limit, True),
+                              (self.month_amount_limit, True),
+                              (self.day_trans_limit, False),
+                              (self.month_trans_limit, False)):
+            if limit == None:
+                shares.append(None)
+                continue
+
+            if amount:
+                total = _to_cents(limit) - 1
+            else:
+                total = int(math.ceil(limit)) - 1
+
+            if total < 0:
+                shares.append(-1)
+                continue
+
+            share = total // self.shards
+            if shard < total % self.shards:
+                share += 1
+            shares.append(share)
+
+        return shares
+
+    def _update_counts(self, session, day_amount_change, month_amount_change,
+                       day_trans_change, month_trans_change, day, month,
+                       check_limits=False, shard=0):
+        """Change counts of a shard with one update statement. With
+        `check_limits` the update is only made if no share of a limit of
+        the shard would be exceeded.
+
+        Returns:
+
+        ``True`` if the counts were updated.
+        """
+        shares = None
+        if check_limits:
+            shares = self._get_shares(shard)
+
+        return _update_provider_counts(session, self.provider,
+            day_amount_change, month_amount_change, day_trans_change,
+            month_trans_change, day, month, shard=shard, shares=shares)
+
+    def _update_windows(self, session, amount, trans, now):
+        """Add counts to current window buckets and check window limits.
+        Buckets from an older window in the same slot are reset as part of
+        the update.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*session*", "object", "SQL session, not commited."
+            "*amount*", "number", "Change in amount count."
+            "*trans*", "number", "Change in trans count."
+            "*now*", "number", "Unix time."
+
+        Raises:
+
+        :attr:`LimitExceeded` If a window limit has been exceeded.
+        """
+        table = CounterWindowTable.__table__
+
+        for window_limit in self.window_limits:
+            epoch = window_limit.get_epoch(now)
+            window = and_(table.c.provider == self.provider,
+                          table.c.window_seconds == window_limit.seconds)
+            same_epoch = table.c.epoch == epoch
+
+            # Epoch is set last, MySQL evaluates assignments left to right
+            session.execute(table.update().where(and_(window,
+                table.c.bucket == epoch % window_limit.buckets)).values(
+                amount_count=case([(same_epoch, table.c.amount_count)],
+                                  else_=0) + _to_cents(amount),
+                trans_count=case([(same_epoch, table.c.trans_count)],
+                                 else_=0) + trans,
+                epoch=epoch,
+            ))
+
+            amount_count, trans_count = session.execute(select([
+                func.sum(table.c.amount_count),
+                func.sum(table.c.trans_count),
+            ]).where(and_(window,
+                table.c.epoch > epoch - window_limit.buckets,
+                table.c.epoch <= epoch))).first()
+
+            window_limit.check((amount_count or 0) / 100.0, trans_count or 0)
+
+    def _split_counts(self, session, amount, trans, day, month):
+        """Split counts across shards by the headroom left in each shard.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*session*", "object", "SQL session."
+            "*amount*", "number", "Amount to split."
+            "*trans*", "number", "Number of transactions to split."
+            "*day*", "number", "Current day period."
+            "*month*", "number", "Current month period."
+
+        Returns:
+
+        List of shard, amount and trans for each shard used sorted by shard
+        so rows are locked in the same order by all workers, ``None`` if the
+        counts don't fit the headroom of all shards.
+        """
+        table = CounterTable.__table__
+        amount_left = _to_cents(amount)
+        trans_left = trans
+        amount_rooms = []
+        trans_rooms = []
+
+        for row in session.execute(table.select().where(and_(
+                table.c.provider == self.provider,
+                table.c.shard < self.shards))):
+            counts = [0, 0, 0, 0]
+            if row.day == day:
+                counts[0] = row.day_amount_count
+                counts[2] = row.day_trans_count
+            if row.month == month:
+                counts[1] = row.month_amount_count
+                counts[3] = row.month_trans_count
+
+            rooms = [None if share == None else share - count
+                     for count, share in zip(counts,
+                     self._get_shares(row.shard))]
+            amount_rooms.append((min([room for room in rooms[:2]
+                if room != None] or [amount_left]), row.shard))
+            trans_rooms.append((min([room for room in rooms[2:]
+                if room != None] or [trans_left]), row.shard))
+
+        parts = {}
+        for rooms, left, index in ((amount_rooms, amount_left, 0),
+                                   (trans_rooms, trans_left, 1)):
+            # Fill shards with the most headroom first
+            for room, shard in sorted(rooms, reverse=True):
+                if left <= 0:
+                    break
+                if room <= 0:
+                    continue
+                part = parts.setdefault(shard, [0, 0])
+                part[index] = min(room, left)
+                left -= part[index]
+
+            if left > 0:
+                return None
+
+        return [(shard, part_amount / 100.0, part_trans)
+                for shard, (part_amount, part_trans) in sorted(parts.items())]
+
+    def reserve(self, amount, trans=1):
+        """Check limits and reserve counts in sql database in one round
+        trip, window limits are checked in the same transaction. If the
+        counts don't fit the shard of the thread they are split across
+        shards."""
+        day, month = period_clock.get_periods()
+        now = time.time()
+
+        if self._write_buffer != None:
+            self._write_buffer.change((amount, amount, trans, trans),
+                                      day, month, check=self._check_limits)
+            return CounterReservation(self, amount, trans, day, month, now)
+
+        with self._session_scope() as session:
+            shard = self._get_shard()
+            parts = [(shard, amount, trans)]
+            updated = self._update_counts(session, amount, amount,
+                trans, trans, day, month, check_limits=True, shard=shard)
+
+            if not updated and self.shards > 1:
+                # Release the row lock of the first shard so rows are only
+                # locked in shard order
+                session.rollback()
+                parts = self._split_counts(session, amount, trans, day, month)
+                updated = parts != None
+                for part_shard, part_amount, part_trans in parts or []:
+                    if not self._update_counts(session, part_amount,
+                            part_amount, part_trans, part_trans, day, month,
+                            check_limits=True, shard=part_shard):
+                        # Headroom taken by another worker
+                        updated = False
+                        break
+
+            if not updated:
+                session.rollback()
+            elif self.window_limits:
+                self._update_windows(session, amount, trans, now)
+
+        if updated:
+            return ShardReservation(self, amount, trans, day, month, now,
+                                    parts)
+
+        # Update was refused, find the limit for the error message
+        self._check_counts(amount, amount, trans, trans)
+        raise LimitExceeded('Gateway limit reached.')
+
+    def _add_period_counts(self, session, changes, day, month, shard=0):
+        """Add count changes of a shard only to the day and month given,
+        counts of a later period are left unchanged."""
+        _add_provider_period_counts(session, self.provider, changes, day,
+                                    month, shard=shard)
+
+    def _release_reservation(self, reservation):
+        """Return reserved counts to sql database. Counts are only returned
+        to the day and month they were reserved in and to the shards they
+        were reserved on, other reservations are returned to the shard of
+        the thread."""
+        if self._write_buffer != None:
+            self._write_buffer.change((
+                reservation.amount * -1, reservation.amount * -1,
+                reservation.trans * -1, reservation.trans * -1,
+            ), reservation.day, reservation.month)
+            return
+
+        window_table = CounterWindowTable.__table__
+
+        if isinstance(reservation, ShardReservation):
+            parts = reservation.parts
+        else:
+            parts = [(self._get_shard(), reservation.amount,
+                      reservation.trans)]
+
+        with self._session_scope() as session:
+            for shard, amount, trans in parts:
+                self._add_period_counts(session, (
+                    amount * -1, amount * -1, trans * -1, trans * -1,
+                ), reservation.day, reservation.month, shard=shard)
+
+            # Counts are only removed from buckets still in the window
+            for window_limit in self.window_limits:
+                epoch = window_limit.get_epoch(reservation.reserved_time)
+                session.execute(window_table.update().where(and_(
+                    window_table.c.provider == self.provider,
+                    window_table.c.window_seconds == window_limit.seconds,
+                    window_table.c.bucket == epoch % window_limit.buckets,
+                    window_table.c.epoch == epoch,
+                )).values(
+                    amount_count=window_table.c.amount_count -
+                                 _to_cents(reservation.amount),
+                    trans_count=window_table.c.trans_count -
+                                reservation.trans,
+                ))
+
+    def _select_counts(self, session, day, month):
+        """Get counts from sql database, counts of all shards are added
+        together."""
+        return _select_provider_counts(session, self.provider, day, month)
+
+    def get_counts(self):
+        """Get counts from sql database."""
+        if self._write_buffer != None:
+            return self._write_buffer.get_counts(
+                    *period_clock.get_periods())
+
+        with self._session_scope() as session:
+            return self._select_counts(session, *period_clock.get_periods())
+
     def set_counts(self, day_amount_change, month_amount_change,
                    day_trans_change, month_trans_change):
         """Set counts in sql database."""
-        session = Session()
-
-        # Get gateway conuter data
-        gateway_data = session.query(CounterTable).filter(
-                        CounterTable.provider == self.provider).first()
-
-        # Increase counts
-        gateway_data.day_amount_count += day_amount_change
-        gateway_data.month_amount_count += month_amount_change
-        gateway_data.day_trans_count += day_trans_change
-        gateway_data.month_trans_count += month_trans_change
-        session.commit()
-        session.close()
+        day, month = period_clock.get_periods()
+
+        if self._write_buffer != None:
+            self._write_buffer.change((day_amount_change,
+                month_amount_change, day_trans_change, month_trans_change),
+                day, month)
+            return
+
+        with self._session_scope() as session:
+            self._update_counts(session, day_amount_change,
+                month_amount_change, day_trans_change, month_trans_change,
+                day, month, shard=self._get_shard())
@@ -0,0 +1,383 @@
+"""Local HTTP server standing in for the gateway providers. Speaks the
+Authorize.Net AIM delimited protocol, the Authorize.Net
+getTransactionDetails XML API and the National Processing transact.php
+protocol so the full gateway HTTP stack can be load tested without hitting
+provider sandboxes.
+
+Usage::
+
+    import payment_processor
+    from payment_processor.stand_in import StandInServer
+
+    server = StandInServer(latency=0.05, decline_rate=0.1).start()
+
+    gateway = payment_processor.AuthorizeNetAIM(
+            login='LOGIN', trans_key='TRANSACTION_KEY',
+            base_url=server.base_url)
+
+The server can also be run from the command line::
+
+    python -m payment_processor.stand_in --port 8000 --latency 0.05
+"""
+from xml.sax.saxutils import escape
+import BaseHTTPServer
+import SocketServer
+import argparse
+import datetime
+import itertools
+import random
+import threading
+import time
+import urllib
+import urlparse
+import xml.dom.minidom
+
+AIM_PATH = '/gateway/transact.dll'
+"""Path of the Authorize.Net AIM endpoint."""
+AIM_REPORT_PATH = '/xml/v1/request.api'
+"""Path of the Authorize.Net reporting XML endpoint."""
+NATIONAL_PROCESSING_PATH = '/api/transact.php'
+"""Path of the National Processing endpoint."""
+
+APPROVED = 'approved'
+DECLINED = 'declined'
+
+AIM_FIELD_COUNT = 45
+
+AIM_STATUSES = dict(
+    AUTH_CAPTURE='capturedPendingSettlement',
+    AUTH_ONLY='authorizedPendingCapture',
+    PRIOR_AUTH_CAPTURE='capturedPendingSettlement',
+    CREDIT='refundPendingSettlement',
+    VOID='voided',
+)
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded stand in gateway server.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*host*", "string", "Host to listen on. Default is `127.0.0.1`."
+        "*port*", "number", "Port to listen on. Default is `0` which picks a
+        free port."
+        "*latency*", "number", "Seconds to wait before each response.
+        Default is `0`."
+        "*latency_jitter*", "number", "Maximum random seconds added to the
+        latency. Default is `0`."
+        "*decline_rate*", "number", "Share of transactions declined. Default
+        is `0`."
+        "*error_rate*", "number", "Share of requests answered with HTTP
+        status 500. Default is `0`."
+        "*max_rps*", "number", "Optional maximum requests per second,
+        requests over the limit are answered with HTTP status 503."
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, latency_jitter=0,
+                 decline_rate=0, error_rate=0, max_rps=None):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port),
+                                           StandInRequestHandler)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.decline_rate = decline_rate
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.transactions = {}
+        self._lock = threading.Lock()
+        self._transaction_ids = itertools.count(2000000000)
+        self._tokens = max_rps
+        self._token_time = time.time()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """Base url to pass to gateways."""
+        return 'http://%s:%s' % self.server_address[:2]
+
+    def start(self):
+        """Start serving requests in a background thread.
+
+        Returns:
+
+        The server instance.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests and close the socket."""
+        self.shutdown()
+        self.server_close()
+        if self._thread != None:
+            self._thread.join()
+            self._thread = None
+
+    def _throttle(self):
+        """Take a token from the request rate bucket.
+
+        Returns:
+
+        ``True`` if the request is within the rate limit.
+        """
+        if self.max_rps == None:
+            return True
+
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.max_rps, self._tokens +
+                               (now - self._token_time) * self.max_rps)
+            self._token_time = now
+
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _outcome(self):
+        """Pick the outcome of a new transaction."""
+        if random.random() < self.decline_rate:
+            return DECLINED
+        return APPROVED
+
+    def _new_transaction_id(self):
+        with self._lock:
+            return str(self._transaction_ids.next())
+
+    def _store_transaction(self, transaction_id, **kwargs):
+        with self._lock:
+            self.transactions[transaction_id] = kwargs
+
+
+class StandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Request handler for :attr:`StandInServer`."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        self._handle(path, query)
+
+    def do_POST(self):
+        path, _, query = self.path.partition('?')
+        length = int(self.headers.getheader('content-length') or 0)
+        body = self.rfile.read(length)
+
+        if path == AIM_REPORT_PATH:
+            self._handle(path, query, body)
+        else:
+            self._handle(path, '&'.join(filter(None, (query, body))))
+
+    def _handle(self, path, query, body=None):
+        server = self.server
+
+        if not server._throttle():
+            return self._respond(503, 'Rate limit exceeded.')
+
+        delay = server.latency
+        if server.latency_jitter:
+            delay += random.uniform(0, server.latency_jitter)
+        if delay:
+            time.sleep(delay)
+
+        if random.random() < server.error_rate:
+            return self._respond(500, 'Internal server error.')
+
+        params = dict((key, values[-1]) for key, values in
+                      urlparse.parse_qs(query, True).items())
+
+        if path == AIM_PATH:
+            self._respond(200, self._aim_response(params))
+        elif path == AIM_REPORT_PATH:
+            self._respond(200, self._aim_report_response(body),
+                          'text/xml; charset=utf-8')
+        elif path == NATIONAL_PROCESSING_PATH:
+            self._respond(200, self._national_processing_response(params))
+        else:
+            self._respond(404, 'Not found.')
+
+    def _respond(self, status_code, body, content_type='text/plain'):
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _aim_response(self, params):
+        """Build an Authorize.Net AIM delimited response."""
+        server = self.server
+        trans_type = params.get('x_type', 'AUTH_CAPTURE')
+        outcome = server._outcome()
+
+        if trans_type in ('PRIOR_AUTH_CAPTURE', 'VOID'):
+            transaction_id = params.get('x_trans_id', '')
+        else:
+            transaction_id = server._new_transaction_id()
+
+        fields = [''] * AIM_FIELD_COUNT
+        if outcome == APPROVED:
+            fields[0:5] = ['1', '1', '1',
+                           'This transaction has been approved.', 'STANDIN']
+            status = AIM_STATUSES.get(trans_type, 'generalError')
+        else:
+            fields[0:5] = ['2', '1', '2',
+                           'This transaction has been declined.', '']
+            status = 'declined'
+
+        fields[5] = 'Y'
+        fields[6] = transaction_id
+        fields[7] = params.get('x_invoice_num', '')
+        fields[8] = params.get('x_description', '')
+        fields[9] = params.get('x_amount', '')
+        fields[10] = params.get('x_method', 'CC')
+        fields[11] = trans_type.lower()
+        fields[12] = params.get('x_cust_id', '')
+        fields[13] = params.get('x_first_name', '')
+        fields[14] = params.get('x_last_name', '')
+        fields[16] = params.get('x_address', '')
+        fields[17] = params.get('x_city', '')
+        fields[18] = params.get('x_state', '')
+        fields[19] = params.get('x_zip', '')
+        fields[38] = 'M'
+        fields[40] = 'XXXX' + params.get('x_card_num', '')[-4:]
+
+        if outcome == APPROVED or trans_type not in ('PRIOR_AUTH_CAPTURE',
+                                                      'VOID'):
+            server._store_transaction(transaction_id, status=status,
+                                      params=params)
+
+        return params.get('x_delim_char', '|').join(fields)
+
+    def _aim_report_response(self, body):
+        """Build an Authorize.Net getTransactionDetails XML response."""
+        try:
+            dom = xml.dom.minidom.parseString(body)
+            transaction_id = dom.getElementsByTagName(
+                'transId')[0].firstChild.nodeValue
+        except Exception:
+            return self._aim_report_error('E00003',
+                                          'The request XML is invalid.')
+
+        transaction = self.server.transactions.get(transaction_id)
+        if transaction == None:
+            return self._aim_report_error('E00040',
+                                          'The record cannot be found.')
+
+        params = transaction['params']
+
+        def value(key):
+            # The gateway client expects every element to have text
+            return escape(params.get(key) or '-')
+
+        if params.get('x_method') == 'ECHECK':
+            payment = ('<bankAccount>' +
+                '<routingNumber>XXXX%s</routingNumber>' +
+                '<accountNumber>XXXX%s</accountNumber>' +
+                '<nameOnAccount>%s</nameOnAccount>' +
+                '<echeckType>%s</echeckType>' +
+                '</bankAccount>') % (
+                    escape(params.get('x_bank_aba_code', '')[-4:]),
+                    escape(params.get('x_bank_acct_num', '')[-4:]),
+                    value('x_bank_acct_name'), value('x_echeck_type'))
+        else:
+            payment = ('<creditCard>' +
+                '<cardNumber>XXXX%s</cardNumber>' +
+                '<expirationDate>XXXX</expirationDate>' +
+                '<cardType>Visa</cardType>' +
+                '</creditCard>') % escape(params.get('x_card_num', '')[-4:])
+
+        submit_time = datetime.datetime.now().strftime(
+            '%Y-%m-%dT%H:%M:%S.000')
+
+        return ('<?xml version="1.0" encoding="utf-8"?>' +
+            '<getTransactionDetailsResponse ' +
+            'xmlns="AnetApi/xml/v1/schema/AnetApiSchema.xsd">' +
+            '<messages><resultCode>Ok</resultCode><message>' +
+            '<code>I00001</code><text>Successful.</text>' +
+            '</message></messages>' +
+            '<transaction>' +
+            '<transId>%s</transId>' +
+            '<submitTimeLocal>%s</submitTimeLocal>' +
+            '<transactionStatus>%s</transactionStatus>' +
+            '<authAmount>%s</authAmount>' +
+            '<payment>%s</payment>' +
+            '<billTo>' +
+            '<firstName>%s</firstName><lastName>%s</lastName>' +
+            '<address>%s</address><city>%s</city>' +
+            '<state>%s</state><zip>%s</zip>' +
+            '</billTo>' +
+            '</transaction>' +
+            '</getTransactionDetailsResponse>') % (
+                escape(transaction_id), submit_time, transaction['status'],
+                value('x_amount'), payment, value('x_first_name'),
+                value('x_last_name'), value('x_address'), value('x_city'),
+                value('x_state'), value('x_zip'))
+
+    def _aim_report_error(self, code, text):
+        return ('<?xml version="1.0" encoding="utf-8"?>' +
+            '<ErrorResponse ' +
+            'xmlns="AnetApi/xml/v1/schema/AnetApiSchema.xsd">' +
+            '<messages><resultCode>Error</resultCode><message>' +
+            '<code>%s</code><text>%s</text>' +
+            '</message></messages></ErrorResponse>') % (code, text)
+
+    def _national_processing_response(self, params):
+        """Build a National Processing query string response."""
+        server = self.server
+        trans_type = params.get('type', 'sale')
+        outcome = server._outcome()
+
+        if trans_type in ('capture', 'void', 'refund'):
+            transaction_id = params.get('transactionid', '')
+        else:
+            transaction_id = server._new_transaction_id()
+
+        if outcome == APPROVED:
+            response = dict(response='1', responsetext='SUCCESS',
+                            authcode='123456', response_code='100')
+        else:
+            response = dict(response='2', responsetext='DECLINE',
+                            authcode='', response_code='260')
+
+        response.update(transactionid=transaction_id, avsresponse='Y',
+                        cvvresponse='M', orderid=params.get('orderid', ''),
+                        type=trans_type)
+
+        server._store_transaction(transaction_id, status=outcome,
+                                  params=params)
+
+        return urllib.urlencode(response)
+
+
+def main():
+    """Run the stand in server from the command line."""
+    parser = argparse.ArgumentParser(description='Stand in gateway server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--latency-jitter', type=float, default=0)
+    parser.add_argument('--decline-rate', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--max-rps', type=float, default=None)
+    args = parser.parse_args()
+
+    server = StandInServer(args.host, args.port, args.latency,
+                           args.latency_jitter, args.decline_rate,
+                           args.error_rate, args.max_rps)
+    print 'Serving on %s' % server.base_url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import time
+
+VALIDATION = 'validation'
+"""Transaction validation phase."""
+COUNTER = 'counter'
+"""Counter check and reservation phase."""
+PARAMS = 'params'
+"""Parameter building phase."""
+NETWORK = 'network'
+"""HTTP request phase."""
+PARSE = 'parse'
+"""Response parsing phase."""
+
+class PhaseTimer(object):
+    """Records the time spent in each phase of sending a transaction. A
+    timer is only created when a timing handler is registered on the
+    gateway so untimed transactions only pay for a ``None`` check.
+    """
+    start_time = None
+    """Time the timer was created."""
+    phases = None
+    """Dictonary of seconds spent in each phase."""
+    attempts = None
+    """List of gateway attempts made by a :attr:`MultiGateway`."""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.phases = {}
+        self.attempts = []
+        self._last_time = self.start_time
+
+    def mark(self, phase):
+        """Add the time since the previous mark to a phase.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*phase*", "string", "Name of phase that just ended."
+        """
+        now = time.time()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self._last_time
+        self._last_time = now
+
+    def start_attempt(self):
+        """Start timing a gateway attempt.
+
+        Returns:
+
+        Start time of the attempt.
+        """
+        self._last_time = time.time()
+        return self._last_time
+
+    def end_attempt(self, gateway, start_time, exception=None):
+        """Record a gateway attempt.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*gateway*", "class", "Gateway instance that was tried."
+            "*start_time*", "number", "Time returned by
+            :attr:`start_attempt`."
+            "*exception*", "class", "Exception raised by the gateway or
+            ``None`` on success."
+        """
+        self.attempts.append(dict(
+            provider=gateway.provider,
+            time=time.time() - start_time,
+            exception=exception,
+        ))
+
+    def get_timings(self):
+        """Get the recorded timings.
+
+        Returns:
+
+        Dictonary containing `total`, `phases` and `attempts`.
+        """
+        return dict(
+            total=time.time() - self.start_time,
+            phases=self.phases,
+            attempts=self.attempts,
+        )
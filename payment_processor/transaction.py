@@ -25,6 +25,9 @@ class Transaction:
     gateway = None
     response_info = None
     _custom_fields = None
+    _deadline = None
+    _timer = None
+    _requests = 0
 
     status = None
     """Status of the transaction"""
@@ -148,9 +151,19 @@ class Transaction:
         """
         self._custom_fields[field] = value
 
-    def charge(self):
+    def charge(self, deadline=None):
         """Authorize and capture the transaction.
 
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*deadline*", "number", "Optional seconds the transaction may
+            take, including any gateway failover. Raises
+            :attr:`DeadlineExceeded` when exceeded."
+
         Requires::
 
             Transaction.amount
@@ -203,11 +216,21 @@ class Transaction:
             transaction_id = transaction.charge()
             print 'transaction_id:', transaction_id
         """
-        return self.gateway._send_transaction(self, '_charge')
+        return self.gateway._send_transaction(self, '_charge', deadline)
 
-    def authorize(self):
+    def authorize(self, deadline=None):
         """Authorize the transaction. Transaction must be captured to complete.
 
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*deadline*", "number", "Optional seconds the transaction may
+            take, including any gateway failover. Raises
+            :attr:`DeadlineExceeded` when exceeded."
+
         Requires::
 
             Transaction.amount
@@ -260,11 +283,21 @@ class Transaction:
             transaction_id = transaction.authorize()
             print 'transaction_id:', transaction_id
         """
-        return self.gateway._send_transaction(self, '_authorize')
+        return self.gateway._send_transaction(self, '_authorize', deadline)
 
-    def capture(self):
+    def capture(self, deadline=None):
         """Capture a previously authorized transaction.
 
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*deadline*", "number", "Optional seconds the transaction may
+            take, including any gateway failover. Raises
+            :attr:`DeadlineExceeded` when exceeded."
+
         Requires::
 
             Transaction.transaction_id
@@ -344,11 +377,21 @@ class Transaction:
             transaction_id = transaction.capture()
             print 'transaction_id:', transaction_id
         """
-        return self.gateway._send_transaction(self, '_capture')
+        return self.gateway._send_transaction(self, '_capture', deadline)
 
-    def refund(self):
+    def refund(self, deadline=None):
         """Refund a previous transaction.
 
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*deadline*", "number", "Optional seconds the transaction may
+            take, including any gateway failover. Raises
+            :attr:`DeadlineExceeded` when exceeded."
+
         Requires::
 
             Transaction.transaction_id
@@ -397,11 +440,21 @@ class Transaction:
             transaction.transaction_id = transaction_id
             transaction.refund()
         """
-        return self.gateway._send_transaction(self, '_refund')
+        return self.gateway._send_transaction(self, '_refund', deadline)
 
-    def credit(self):
+    def credit(self, deadline=None):
         """Credit a previous transaction.
 
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*deadline*", "number", "Optional seconds the transaction may
+            take, including any gateway failover. Raises
+            :attr:`DeadlineExceeded` when exceeded."
+
         Returns:
 
         Transaction ID.
@@ -446,11 +499,21 @@ class Transaction:
             transaction.transaction_id = transaction_id
             transaction.credit()
         """
-        return self.gateway._send_transaction(self, '_credit')
+        return self.gateway._send_transaction(self, '_credit', deadline)
 
-    def void(self):
+    def void(self, deadline=None):
         """Void a previous transaction.
 
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*deadline*", "number", "Optional seconds the transaction may
+            take, including any gateway failover. Raises
+            :attr:`DeadlineExceeded` when exceeded."
+
         Requires::
 
             Transaction.transaction_id
@@ -499,11 +562,21 @@ class Transaction:
             transaction.transaction_id = transaction_id
             transaction.void()
         """
-        return self.gateway._send_transaction(self, '_void')
+        return self.gateway._send_transaction(self, '_void', deadline)
 
-    def status(self):
+    def status(self, deadline=None):
         """Get the status of a previous transaction.
 
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*deadline*", "number", "Optional seconds the transaction may
+            take, including any gateway failover. Raises
+            :attr:`DeadlineExceeded` when exceeded."
+
         Returns:
 
         Transaction ID.
@@ -548,4 +621,161 @@ class Transaction:
             transaction.transaction_id = transaction_id
             transaction.status()
         """
-        return self.gateway._send_transaction(self, '_status')
+        return self.gateway._send_transaction(self, '_status', deadline)
+
+    def charge_async(self, callback=None, deadline=None):
+        """Authorize and capture the transaction without blocking. See
+        :attr:`charge`.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*callback*", "function", "Optional function called with the
+            transaction ID on success."
+            "*deadline*", "number", "Optional seconds the transaction may
+            take once it is sent."
+
+        Returns:
+
+        Instance of :attr:`multiprocessing.pool.AsyncResult`, ``get()``
+        returns the transaction ID.
+        """
+        return self.gateway._send_transaction_async(self, '_charge',
+            callback=callback, deadline=deadline)
+
+    def authorize_async(self, callback=None, deadline=None):
+        """Authorize the transaction without blocking. See :attr:`authorize`.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*callback*", "function", "Optional function called with the
+            transaction ID on success."
+            "*deadline*", "number", "Optional seconds the transaction may
+            take once it is sent."
+
+        Returns:
+
+        Instance of :attr:`multiprocessing.pool.AsyncResult`, ``get()``
+        returns the transaction ID.
+        """
+        return self.gateway._send_transaction_async(self, '_authorize',
+            callback=callback, deadline=deadline)
+
+    def capture_async(self, callback=None, deadline=None):
+        """Capture a previously authorized transaction without blocking. See
+        :attr:`capture`.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*callback*", "function", "Optional function called with the
+            transaction ID on success."
+            "*deadline*", "number", "Optional seconds the transaction may
+            take once it is sent."
+
+        Returns:
+
+        Instance of :attr:`multiprocessing.pool.AsyncResult`, ``get()``
+        returns the transaction ID.
+        """
+        return self.gateway._send_transaction_async(self, '_capture',
+            callback=callback, deadline=deadline)
+
+    def refund_async(self, callback=None, deadline=None):
+        """Refund a previous transaction without blocking. See :attr:`refund`.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*callback*", "function", "Optional function called with the
+            transaction ID on success."
+            "*deadline*", "number", "Optional seconds the transaction may
+            take once it is sent."
+
+        Returns:
+
+        Instance of :attr:`multiprocessing.pool.AsyncResult`, ``get()``
+        returns the transaction ID.
+        """
+        return self.gateway._send_transaction_async(self, '_refund',
+            callback=callback, deadline=deadline)
+
+    def credit_async(self, callback=None, deadline=None):
+        """Credit a previous transaction without blocking. See :attr:`credit`.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*callback*", "function", "Optional function called with the
+            transaction ID on success."
+            "*deadline*", "number", "Optional seconds the transaction may
+            take once it is sent."
+
+        Returns:
+
+        Instance of :attr:`multiprocessing.pool.AsyncResult`, ``get()``
+        returns the transaction ID.
+        """
+        return self.gateway._send_transaction_async(self, '_credit',
+            callback=callback, deadline=deadline)
+
+    def void_async(self, callback=None, deadline=None):
+        """Void a previous transaction without blocking. See :attr:`void`.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*callback*", "function", "Optional function called with the
+            transaction ID on success."
+            "*deadline*", "number", "Optional seconds the transaction may
+            take once it is sent."
+
+        Returns:
+
+        Instance of :attr:`multiprocessing.pool.AsyncResult`, ``get()``
+        returns the transaction ID.
+        """
+        return self.gateway._send_transaction_async(self, '_void',
+            callback=callback, deadline=deadline)
+
+    def status_async(self, callback=None, deadline=None):
+        """Get the status of a previous transaction without blocking. See
+        :attr:`status`.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*callback*", "function", "Optional function called with the
+            transaction ID on success."
+            "*deadline*", "number", "Optional seconds the transaction may
+            take once it is sent."
+
+        Returns:
+
+        Instance of :attr:`multiprocessing.pool.AsyncResult`, ``get()``
+        returns the transaction ID.
+        """
+        return self.gateway._send_transaction_async(self, '_status',
+            callback=callback, deadline=deadline)
@@ -0,0 +1,153 @@
+from payment_processor.exceptions import *
+
+class WindowLimit(object):
+    """Sliding window limit. The window is split into time buckets, counts
+    older than the window are dropped one bucket at a time so the limit
+    covers between `seconds` minus one bucket and `seconds`.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*seconds*", "number", "Length of window in whole seconds."
+        "*amount_limit*", "number", "Total amount of money that can be
+        transferred in the window."
+        "*trans_limit*", "number", "Number of transaction that can occur in
+        the window."
+        "*buckets*", "number", "Number of time buckets. Default is `60`."
+
+    Usage::
+
+        import payment_processor
+
+        AuthorizeNetAIMCounted = payment_processor.counted_gateway(
+            payment_processor.AuthorizeNetAIM,
+            payment_processor.GatewayCounter)
+
+        gateway = AuthorizeNetAIMCounted(
+                login='LOGIN', trans_key='TRANSACTION_KEY',
+                window_limits=[
+                    payment_processor.WindowLimit(86400, amount_limit=10000),
+                    payment_processor.WindowLimit(60, trans_limit=100),
+                ])
+    """
+    seconds = None
+    """Length of window in seconds."""
+    amount_limit = None
+    """Total amount of money that can be transferred in the window."""
+    trans_limit = None
+    """Number of transaction that can occur in the window."""
+    buckets = None
+    """Number of time buckets."""
+
+    def __init__(self, seconds, amount_limit=None, trans_limit=None,
+                 buckets=60):
+        self.seconds = seconds
+        self.amount_limit = amount_limit
+        self.trans_limit = trans_limit
+        self.buckets = buckets
+        self._bucket_width = float(seconds) / buckets
+
+    def get_epoch(self, now):
+        """Get number of bucket containing time.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*now*", "number", "Unix time."
+
+        Returns:
+
+        Bucket number, bucket slot is the number modulo :attr:`buckets`.
+        """
+        return int(now // self._bucket_width)
+
+    def check(self, amount_count, trans_count):
+        """Check window counts against limits.
+
+        Arguments:
+
+        .. csv-table::
+            :header: "argument", "type", "value"
+            :widths: 7, 7, 40
+
+            "*amount_count*", "number", "Amount count of window."
+            "*trans_count*", "number", "Trans count of window."
+
+        Raises:
+
+        :attr:`LimitExceeded` If a limit has been exceeded.
+        """
+        if (amount_count >= self.amount_limit and
+                self.amount_limit != None):
+            raise LimitExceeded('Gateway %s second amount limit reached.' %
+                                self.seconds)
+
+        if (trans_count >= self.trans_limit and
+                self.trans_limit != None):
+            raise LimitExceeded('Gateway %s second transaction limit ' \
+                                'reached.' % self.seconds)
+
+
+class WindowCounts(object):
+    """In memory ring buffer of window bucket counts.
+
+    Arguments:
+
+    .. csv-table::
+        :header: "argument", "type", "value"
+        :widths: 7, 7, 40
+
+        "*buckets*", "number", "Number of time buckets."
+    """
+    __slots__ = ('epochs', 'amount_counts', 'trans_counts')
+
+    def __init__(self, buckets):
+        self.epochs = [None] * buckets
+        self.amount_counts = [0] * buckets
+        self.trans_counts = [0] * buckets
+
+    def get_counts(self, epoch):
+        """Get total counts of buckets in the window ending with bucket
+        number.
+
+        Returns:
+
+        A tuple containing `amount_count`, `trans_count`
+        """
+        oldest_epoch = epoch - len(self.epochs)
+        amount_count = 0
+        trans_count = 0
+
+        for index, bucket_epoch in enumerate(self.epochs):
+            if bucket_epoch != None and oldest_epoch < bucket_epoch <= epoch:
+                amount_count += self.amount_counts[index]
+                trans_count += self.trans_counts[index]
+
+        return amount_count, trans_count
+
+    def change(self, epoch, amount_change, trans_change):
+        """Change counts of bucket number. A bucket from an older window in
+        the same slot is reset first."""
+        index = epoch % len(self.epochs)
+
+        if self.epochs[index] != epoch:
+            self.epochs[index] = epoch
+            self.amount_counts[index] = 0
+            self.trans_counts[index] = 0
+
+        self.amount_counts[index] += amount_change
+        self.trans_counts[index] += trans_change
+
+    def release(self, epoch, amount, trans):
+        """Remove counts from bucket number if it is still in the ring."""
+        index = epoch % len(self.epochs)
+
+        if self.epochs[index] == epoch:
+            self.amount_counts[index] -= amount
+            self.trans_counts[index] -= trans
@@ -0,0 +1,87 @@
+"""Tests of the redis gateway counter. Skipped when redis or a redis server
+is not aviable, set ``PAYMENT_PROCESSOR_REDIS_URL`` to the server to use.
+
+Usage::
+
+    python -m unittest discover tests
+"""
+import os
+import unittest
+
+try:
+    import redis
+    from payment_processor.redis_counter import RedisGatewayCounter
+    import payment_processor.redis_counter as redis_counter
+except Exception:
+    redis = None
+
+import payment_processor
+
+REDIS_URL = os.environ.get('PAYMENT_PROCESSOR_REDIS_URL',
+                           'redis://localhost:6379/15')
+
+
+def _redis_aviable():
+    """Check that a redis server answers at the test url."""
+    if redis == None:
+        return False
+    try:
+        return redis.StrictRedis.from_url(REDIS_URL,
+            socket_connect_timeout=1).ping()
+    except redis.RedisError:
+        return False
+
+
+@unittest.skipUnless(_redis_aviable(), 'Redis server not aviable.')
+class RedisGatewayCounterTest(unittest.TestCase):
+
+    def setUp(self):
+        redis_counter.connect_redis(REDIS_URL)
+        self.client = redis.StrictRedis.from_url(REDIS_URL)
+        for key in self.client.keys('%s:test_*' % redis_counter.KEY_PREFIX):
+            self.client.delete(key)
+
+    def _counter(self, **limits):
+        Counter = payment_processor.counted_gateway(
+            payment_processor.Dummy, RedisGatewayCounter)
+
+        class TestCounter(Counter):
+            provider = 'test_' + self.id().rsplit('.', 1)[-1]
+
+        return TestCounter(**limits)
+
+    def test_amounts_stored_in_cents(self):
+        counter = self._counter()
+        for _ in xrange(10):
+            counter.reserve(0.1).commit()
+
+        self.assertEqual(counter.get_counts(), (1.0, 1.0, 10, 10))
+
+        day_key, month_key = counter._get_keys(
+            *redis_counter.period_clock.get_periods())
+        self.assertEqual(self.client.hget(day_key, 'amount_cents'), '100')
+
+    def test_amount_limit_is_exact(self):
+        counter = self._counter(day_amount_limit=1.0)
+        for _ in xrange(9):
+            counter.reserve(0.1).commit()
+
+        # 0.9 + 0.1 reaches the limit
+        self.assertRaises(payment_processor.LimitExceeded,
+                          counter.reserve, 0.1)
+        counter.reserve(0.09).commit()
+        self.assertEqual(counter.get_counts()[0], 0.99)
+
+    def test_release_returns_counts(self):
+        counter = self._counter(day_trans_limit=2)
+        reservation = counter.reserve(19.95)
+        self.assertRaises(payment_processor.LimitExceeded,
+                          counter.reserve, 1)
+
+        reservation.release()
+        self.assertEqual(counter.get_counts(), (0.0, 0.0, 0, 0))
+        counter.reserve(1).commit()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Tests of the shared memory gateway counter. Skipped when fcntl is not
+aviable.
+
+Usage::
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+try:
+    from payment_processor.shm_counter import SharedMemoryGatewayCounter
+    import payment_processor.shm_counter as shm_counter
+except Exception:
+    shm_counter = None
+
+import payment_processor
+
+
+@unittest.skipIf(shm_counter == None, 'Shared memory counter not aviable.')
+class SharedMemoryGatewayCounterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'counters')
+        shm_counter.connect_shared_memory(self.path)
+
+    def tearDown(self):
+        if shm_counter._segment != None:
+            shm_counter._segment.close()
+            shm_counter._segment = None
+        shutil.rmtree(self.directory)
+
+    def _counter(self, **limits):
+        Counter = payment_processor.counted_gateway(
+            payment_processor.Dummy, SharedMemoryGatewayCounter)
+        return Counter(**limits)
+
+    def test_amounts_stored_in_cents(self):
+        counter = self._counter()
+        for _ in xrange(10):
+            counter.reserve(0.1).commit()
+
+        self.assertEqual(counter.get_counts(), (1.0, 1.0, 10, 10))
+
+        segment, index = counter._get_slot()
+        with segment.lock_slot(index) as offset:
+            day_amount_count = segment.read_counts(offset,
+                *shm_counter.period_clock.get_periods())[0]
+        self.assertEqual(day_amount_count, 100)
+
+    def test_amount_limit_is_exact(self):
+        counter = self._counter(day_amount_limit=10)
+        for _ in xrange(99):
+            counter.reserve(0.1).commit()
+
+        # 9.9 + 0.1 reaches the limit
+        self.assertRaises(payment_processor.LimitExceeded,
+                          counter.reserve, 0.1)
+        self.assertEqual(counter.get_counts()[0], 9.9)
+
+    def test_release_returns_counts(self):
+        counter = self._counter(day_trans_limit=2)
+        reservation = counter.reserve(19.95)
+        self.assertRaises(payment_processor.LimitExceeded,
+                          counter.reserve, 1)
+
+        reservation.release()
+        self.assertEqual(counter.get_counts(), (0.0, 0.0, 0, 0))
+        counter.reserve(1).commit()
+
+    def test_version_1_file_is_refused(self):
+        shm_counter._segment.close()
+        shm_counter._segment = None
+        os.remove(self.path)
+
+        with open(self.path, 'wb') as counter_file:
+            counter_file.write(struct.pack('=8sI', 'PPCOUNT1', 1).ljust(
+                shm_counter.SLOT_SIZE * 2, '\0'))
+
+        self.assertRaises(payment_processor.CounterError,
+                          shm_counter.connect_shared_memory, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()